@@ -1,21 +1,59 @@
+from typing import Iterable
+
 _BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+_DIGITS = {c: i for i, c in enumerate(_BASE58_ALPHABET)}
+_PAIRS = [a + b for a in _BASE58_ALPHABET for b in _BASE58_ALPHABET]  # 58 ** 2 two-digit strings
+_PAIR_VALUES = {pair: i for i, pair in enumerate(_PAIRS)}
+_CHUNK = 58 ** 10  # ten digits (five pairs) are combined as a small int before touching the big one
 
 
-def encode(number: int | str):  # supports numbers in hex strings
+def encode(number: int | str | bytes):  # supports numbers in hex strings, bytes keep their leading zeros
+    if isinstance(number, (bytes, bytearray, memoryview)):
+        return encode_bytes(number)
     if isinstance(number, str):
         number = int(number, 16)
-    encode_result = ''
-    while number > 0:
-        number, rem = divmod(number, 58)
-        encode_result = _BASE58_ALPHABET[rem] + encode_result
-    return encode_result
+    pairs = []
+    while number > 0:  # two digits per divmod
+        number, rem = divmod(number, 3364)
+        pairs.append(_PAIRS[rem])
+    pairs.reverse()
+    return ''.join(pairs).lstrip('1')  # the first pair might be zero-padded
+
+def encode_bytes(data: bytes) -> str:  # Bitcoin style: every leading zero byte becomes a leading '1'
+    data = bytes(data)
+    stripped = data.lstrip(b'\0')
+    return '1' * (len(data) - len(stripped)) + encode(int.from_bytes(stripped, 'big'))
 
 
 def decode_int(base58) -> int:
     num = 0
-    for char in base58:
-        num = num * 58 + _BASE58_ALPHABET.index(char)
+    head = len(base58) % 10
+    pair = _PAIR_VALUES
+    try:
+        for char in base58[:head]:
+            num = num * 58 + _DIGITS[char]
+        for i in range(head, len(base58), 10):
+            chunk = pair[base58[i:i + 2]]
+            chunk = chunk * 3364 + pair[base58[i + 2:i + 4]]
+            chunk = chunk * 3364 + pair[base58[i + 4:i + 6]]
+            chunk = chunk * 3364 + pair[base58[i + 6:i + 8]]
+            chunk = chunk * 3364 + pair[base58[i + 8:i + 10]]
+            num = num * _CHUNK + chunk
+    except KeyError as e:
+        raise ValueError(f'Invalid base58 character in {e}')
     return num
 
 def decode_hex(base58) -> str:
     return hex(decode_int(base58))[2:]
+
+def decode_bytes(base58: str) -> bytes:  # reverses encode_bytes, leading '1's become zero bytes
+    stripped = base58.lstrip('1')
+    num = decode_int(stripped)
+    return bytes(len(base58) - len(stripped)) + num.to_bytes((num.bit_length() + 7) // 8, 'big')
+
+
+def encode_many(items: Iterable[int | str | bytes]) -> list[str]:
+    return [encode(item) for item in items]
+
+def decode_many(base58s: Iterable[str]) -> list[bytes]:
+    return [decode_bytes(b) for b in base58s]
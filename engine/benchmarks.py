@@ -0,0 +1,673 @@
+import argparse
+import asyncio
+import inspect
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Iterable, Iterator
+from engine import generator, op
+from engine.generator import DecoyOutput, generate_arithmetic_script, generate_tx, weighed_choice
+from engine.sampling import Sampler, UpdatableSampler
+from engine.script import CompiledScript, ScriptCache, apply_script, decode_script, encode_script, verification_cache
+from engine import base58, metrics, wire
+from engine.chain import Chain
+from engine.exception import VerifyFailed
+from engine.corpus import write_corpus
+from engine.game import Game
+from engine.mempool import Mempool
+from engine.server import GameServer, load_test
+from engine.pipeline import Pipeline, printable
+from engine.snapshot import restore, snapshot
+from engine.nonce import NonceSearch, parallel_search, target_for_bits
+from engine.structs import Block, OpCode, OpPushBytes, OpX, Transaction, TxOutput
+from engine.utxo import UtxoSet, SqliteUtxoStore
+from engine.validator import Validator
+from engine.settings import SCRIPT_LENGTH
+
+_ERROR_WEIGHTS = {'none': 6, 'script_failed': 1, 'negative_fee': 1, 'invalid_input': 1, 'already_spent': 1}
+
+
+def _timed(func, repeat: int) -> float:  # seconds per call
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+# workloads shared by the benchmarks below and the regression check at the end
+
+def _scripts(count: int) -> list[list[OpCode]]:  # every other script fails verification
+    return [generate_arithmetic_script(correct=i % 2 == 0) for i in range(count)]
+
+
+def _outputs(size: int) -> Iterator[TxOutput]:  # 4 outputs per transaction, with ids '0', '1', ...
+    script = generate_arithmetic_script(correct=False)[2:]
+    return (TxOutput(str(i // 4), i % 4, script, 1_000) for i in range(size))
+
+
+def _lookup_ids(size: int, count: int) -> list[str]:  # random transaction ids out of _outputs(size)
+    return [str(random.randrange(size // 4)) for _ in range(count)]
+
+
+def _transactions(count: int) -> list[Transaction]:
+    sources = []
+    return [generate_tx(sources) for _ in range(count)]
+
+
+def _block(txs: list[Transaction]) -> Block:
+    block = Block()
+    for tx in txs:
+        block.add(tx)
+    return block
+
+
+def _ids(count: int) -> list[int]:  # 256-bit numbers, like the ones behind transaction ids
+    return [random.getrandbits(256) for _ in range(count)]
+
+
+def _inspecting_apply(opc: OpCode, stack: list):  # the original OpCode.apply, with inspect.signature for every op
+    try:
+        argnum = len(inspect.signature(opc.body).parameters)
+    except ValueError:  # builtins (min, max) have no signature, the original never got past them
+        argnum = opc.argnum
+    if len(stack) < argnum:
+        raise IndexError('Not enough elements on the stack')
+    if argnum == 0:
+        ret = opc.body()
+    else:
+        args = stack[-argnum:]
+        del stack[-argnum:]
+        ret = opc.body(*args)
+    if ret is not None:
+        if type(ret) is list or type(ret) is tuple:
+            stack.extend(ret)
+        else:
+            stack.append(ret)
+
+
+def _inspecting_script(script: list[OpCode]) -> VerifyFailed | None:  # apply_script on top of _inspecting_apply
+    stack = []
+    try:
+        for opc in script:
+            _inspecting_apply(opc, stack)
+    except IndexError as e:
+        return VerifyFailed(str(e))
+    except VerifyFailed as e:
+        return e
+    if len(stack) > 0 and stack[-1] == 0:
+        return VerifyFailed('Script finished with false on top of the stack')
+    return None
+
+
+def bench_script_execution(scripts_num: int = 2_000, repeat: int = 20):
+    scripts = _scripts(scripts_num)
+    compiled = [CompiledScript(s) for s in scripts]
+    ops = sum(len(s) for s in scripts)
+
+    def run_inspecting():
+        for s in scripts:
+            _inspecting_script(s)
+
+    def run_apply():
+        for s in scripts:
+            apply_script(s)
+
+    def run_compiled():
+        for c in compiled:
+            c.evaluate()
+
+    inspecting_time = _timed(run_inspecting, repeat)
+    apply_time = _timed(run_apply, repeat)
+    compiled_time = _timed(run_compiled, repeat)
+    print(f'inspect.signature per op: {ops / inspecting_time:,.0f} ops/sec')
+    print(f'OpCode.apply:             {ops / apply_time:,.0f} ops/sec ({inspecting_time / apply_time:.1f}x)')
+    print(f'CompiledScript:           {ops / compiled_time:,.0f} ops/sec ({inspecting_time / compiled_time:.1f}x)')
+
+
+def bench_validator(tx_num: int = 10_000, copies: int = 10):
+    sources = []
+    txs = [generate_tx(sources) for _ in range(tx_num)]
+    verification_cache.clear()
+    print('Cold: ' + Validator(sources).validate_batch(txs).printable())
+    print('Warm: ' + Validator(sources).validate_batch(txs * copies).printable())  # a new validator, same cache
+    small = ScriptCache(max_size=tx_num // 2)  # half the scripts fit, the rest keep evicting each other
+    print('Small cache: ' + Validator(sources, small).validate_batch(txs * copies).printable())
+
+
+def bench_utxo_lookup(sizes: tuple = (1_000, 10_000, 100_000, 1_000_000), lookups: int = 100_000):  # add 10_000_000 with ~5GB of RAM
+    for size in sizes:
+        utxos = UtxoSet(_outputs(size))
+        tx_ids = _lookup_ids(size, lookups)
+        start = time.perf_counter()
+        for tx_id in tx_ids:
+            utxos.lookup(tx_id)
+        per_lookup = (time.perf_counter() - start) / lookups
+        print(f'{size:>12,} outputs: {per_lookup * 1e9:,.0f} ns per lookup')
+
+
+def bench_sqlite_utxo_store(size: int = 1_000_000, lookups: int = 100_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteUtxoStore(os.path.join(tmp, 'utxo.sqlite3'), cache_size=10_000)
+        start = time.perf_counter()
+        store.extend(_outputs(size))
+        print(f'Bulk insert: {size / (time.perf_counter() - start):,.0f} outputs/sec')
+        keys = [(str(random.randrange(size // 4)), random.randrange(4)) for _ in range(lookups)]
+        start = time.perf_counter()
+        for tx_id, index in keys:
+            store.get(tx_id, index)
+        print(f'Point lookup: {(time.perf_counter() - start) / lookups * 1e6:,.1f} us per lookup')
+        start = time.perf_counter()
+        for tx_id, index in keys[:10_000]:
+            store.mark_spent(tx_id, index)
+        print(f'Mark spent: {(time.perf_counter() - start) / 10_000 * 1e6:,.1f} us per output')
+        store.close()
+
+
+def bench_nonce_search(block_size: int = 3_500, hashes: int = 200_000):
+    block = _block(_transactions(block_size))
+    naive_hashes = max(hashes // 100, 1)
+    naive_time = _timed(lambda: [block.hash(n) for n in range(naive_hashes)], 1) / naive_hashes
+    search = NonceSearch(block, target=target_for_bits(160))  # unreachable target, scans the whole range
+    midstate_time = _timed(lambda: search.search(0, hashes), 1) / hashes
+    print(f'Block.hash:  {1 / naive_time:,.0f} hashes/sec ({block_size} transactions)')
+    print(f'NonceSearch: {1 / midstate_time:,.0f} hashes/sec ({naive_time / midstate_time:.0f}x)')
+
+
+def bench_parallel_nonce_search(hashes: int = 4_000_000, max_workers: int | None = None):
+    block = _block(_transactions(100))
+    unreachable = target_for_bits(160)  # every worker scans its whole share
+    single = None
+    for workers in range(1, (max_workers or os.cpu_count() or 1) + 1):
+        result = parallel_search(block, workers=workers, target=unreachable, stop=hashes)
+        single = single or result.hashrate
+        print(f'{workers:>3} workers: {result.hashrate:,.0f} H/s ({result.hashrate / single:.2f}x)')
+
+
+def bench_block_hash(sizes: tuple = (2, 100, 3_500, 20_000), hashes: int = 20_000):
+    txs = _transactions(max(sizes))
+    for size in sizes:
+        block = Block()
+        add_time = _timed(lambda: [block.add(tx) for tx in txs[:size]], 1) / size
+        hash_time = _timed(lambda: [block.hash(n) for n in range(hashes)], 1) / hashes
+        print(f'{size:>7,} transactions: {add_time * 1e6:.1f} us per add, {hash_time * 1e6:.2f} us per hash')
+
+
+def bench_corpus_generation(count: int = 100_000, workers: int | None = None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.bin')
+        tx_per_sec = write_corpus(path, count, seed=1, workers=workers)
+        print(f'Corpus of {count:,} transactions: {tx_per_sec:,.0f} tx/sec, {os.path.getsize(path) / count:.0f} bytes/tx')
+
+
+def bench_weighted_sampling(draws: int = 200_000):
+    sampler = Sampler(_ERROR_WEIGHTS, random.Random())
+    choice_time = _timed(lambda: [weighed_choice(_ERROR_WEIGHTS) for _ in range(draws)], 1)
+    draw_time = _timed(lambda: [sampler.draw() for _ in range(draws)], 1)
+    sample_time = _timed(lambda: sampler.sample(draws), 1)
+    print(f'weighed_choice:   {draws / choice_time:,.0f} draws/sec')
+    print(f'Sampler.draw:     {draws / draw_time:,.0f} draws/sec')
+    print(f'Sampler.sample:   {draws / sample_time:,.0f} draws/sec')
+    print(f'Script generation: {1 / _timed(lambda: generate_arithmetic_script(True), 10_000):,.0f} scripts/sec')
+
+
+def _retrying_operations(rejected: list[int]) -> tuple[list, int]:  # the original loop, drawing from everything
+    reductions = Sampler(generator._reductions, generator._rng)
+    neutrals = Sampler(generator._neutrals, generator._rng)
+    expansions = Sampler(generator._expansions, generator._rng)
+    instructions, stack = [], []
+    strategy = UpdatableSampler({'reduce': 0, 'keep': SCRIPT_LENGTH, 'expand': 2 * SCRIPT_LENGTH}, generator._rng)
+    for _ in range(2):
+        item = generator._rng.randint(-1, 16)
+        instructions.append(op.push_number(item))
+        stack.append(item)
+    while len(stack) > 1:
+        step = strategy.draw()
+        operation = {'reduce': reductions, 'keep': neutrals, 'expand': expansions}[step].draw()
+        if operation == 0:
+            operation = op.push_number(generator._rng.randint(-1, 16))
+        try:
+            operation.apply(stack)
+            instructions.append(operation)
+            if strategy.weights['expand'] > 1:
+                strategy.update('expand', -1)
+                strategy.update('reduce', 1)
+        except (ValueError, IndexError):
+            rejected[0] += 1
+    return instructions, stack[0]
+
+
+def _counts(runs: list[tuple[list, int]]) -> dict[str, int]:  # how often each opcode shows up
+    counts = {}
+    for instructions, _ in runs:
+        for opc in instructions[2:]:
+            counts[opc.name] = counts.get(opc.name, 0) + 1
+    return counts
+
+
+def _illegal(runs: list[tuple[list, int]]) -> int:  # operations that did not fit the stack, found by running them again
+    illegal = 0
+    for instructions, _ in runs:
+        stack = []
+        for opc in instructions:
+            try:
+                opc.apply(stack)
+            except (ValueError, IndexError):
+                illegal += 1
+    return illegal
+
+
+def bench_script_generation(scripts_num: int = 50_000):
+    rejected = [0]
+    start = time.perf_counter()
+    retrying = [_retrying_operations(rejected) for _ in range(scripts_num)]
+    retrying_time = time.perf_counter() - start
+    start = time.perf_counter()
+    legal = [generator._arithmetic_operations() for _ in range(scripts_num)]
+    legal_time = time.perf_counter() - start
+    print(f'Retrying loop:     {scripts_num / retrying_time:,.0f} scripts/sec, {rejected[0]:,} rejected operations')
+    print(f'Stack-effect loop: {scripts_num / legal_time:,.0f} scripts/sec, {_illegal(legal):,} operations '
+          f'that do not fit the stack ({retrying_time / legal_time:.2f}x)')
+
+    old, new = _counts(retrying), _counts(legal)
+    old_total, new_total = sum(old.values()), sum(new.values())
+    distance, noise = 0.0, 0.0
+    for name in old.keys() | new.keys():
+        p, q = old.get(name, 0) / old_total, new.get(name, 0) / new_total
+        distance += abs(p - q) / 2
+        pooled = (old.get(name, 0) + new.get(name, 0)) / (old_total + new_total)
+        # mean |p - q| of two samples of the same distribution, sqrt(2 / pi) * standard deviation
+        noise += math.sqrt(2 / math.pi * pooled * (1 - pooled) * (1 / old_total + 1 / new_total)) / 2
+    print(f'Opcode frequencies differ by {distance:.2%} (total variation), two samples of the same '
+          f'distribution differ by {noise:.2%} on average')
+    for label, runs in (('Retrying', retrying), ('Stack-effect', legal)):
+        lengths = [len(i) for i, _ in runs]
+        results = [r for _, r in runs]
+        print(f'{label:<13} mean length {sum(lengths) / len(lengths):.2f}, mean result {sum(results) / len(results):.2f}')
+
+
+def _naive_base58(number: int) -> str:  # the original codec, prepending one digit at a time
+    encode_result = ''
+    while number > 0:
+        number, rem = divmod(number, 58)
+        encode_result = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'[rem] + encode_result
+    return encode_result
+
+
+def bench_base58(items: int = 50_000):
+    numbers = _ids(items)
+    encoded = base58.encode_many(numbers)
+    naive_time = _timed(lambda: [_naive_base58(n) for n in numbers], 1)
+    encode_time = _timed(lambda: base58.encode_many(numbers), 1)
+    decode_time = _timed(lambda: [base58.decode_int(e) for e in encoded], 1)
+    print(f'Naive encode: {items / naive_time:,.0f} ids/sec')
+    print(f'Encode:       {items / encode_time:,.0f} ids/sec ({naive_time / encode_time:.1f}x)')
+    print(f'Decode:       {items / decode_time:,.0f} ids/sec')
+
+
+def bench_wire_format(tx_num: int = 20_000):
+    sources = []
+    txs = [generate_tx(sources) for _ in range(tx_num)]
+    records = sources + txs
+    data = wire.encode_records(records)
+    encode_time = _timed(lambda: wire.encode_records(records), 1)
+    decode_time = _timed(lambda: sum(1 for _ in wire.iter_records(data)), 1)
+    print(f'{len(data) / len(records):.0f} bytes per record')
+    print(f'Encode: {len(records) / encode_time:,.0f} records/sec')
+    print(f'Decode: {len(records) / decode_time:,.0f} records/sec')
+
+
+def _fresh_decode(raw: bytes) -> list:  # like before the shared opcode table: a new object for every push
+    script = []
+    for opc in decode_script(raw):
+        if isinstance(opc, OpPushBytes):
+            opc = OpPushBytes(opc.hex_bytes)
+        elif opc.name.startswith('OP_') and opc.name[3:].isdigit() or opc.name == 'OP_1NEGATE':
+            opc = OpX(opc.body())
+        script.append(opc)
+    return script
+
+
+def bench_script_decoding(scripts_num: int = 20_000):
+    raw = [encode_script(s) for s in _scripts(scripts_num)]
+    for name, decode in (('Fresh objects', _fresh_decode), ('Shared table', decode_script)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        decoded = [decode(r) for r in raw]
+        elapsed = time.perf_counter() - start
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f'{name}: {scripts_num / elapsed:,.0f} scripts/sec, {memory / len(decoded):.0f} bytes per script')
+
+
+class _DictTxOutput:  # TxOutput as it was before __slots__, for comparison
+    def __init__(self, tx_id: str, index: int, script: list, amount: int):
+        self.tx_id = tx_id
+        self.index = index
+        self.script = script
+        self.amount = amount
+        self.spent = False
+
+
+def bench_utxo_memory(sizes: tuple = (1_000_000,)):  # add 10_000_000 with ~8GB of RAM
+    script = generate_arithmetic_script(correct=False)[2:]
+    for size in sizes:
+        for name, cls in (('dict-backed', _DictTxOutput), ('slotted', TxOutput)):
+            tracemalloc.start()
+            utxos = UtxoSet(cls(f'{i // 4:044d}', i % 4, script, 1_000) for i in range(size))
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f'{size:>12,} outputs, {name}: {memory / len(utxos):.0f} bytes per UTXO')
+            del utxos
+
+
+def bench_decoy_outputs(tx_num: int = 20_000):
+    sources = []
+    lazy_time = _timed(lambda: generate_tx(sources), tx_num)
+    decoys = sum(1 for src in sources if isinstance(src, DecoyOutput)) / tx_num
+    script_time = _timed(lambda: generate_arithmetic_script(correct=False), 10_000)  # what every decoy used to cost
+    print(f'{decoys:.1f} decoys per transaction')
+    print(f'Lazy decoys:  {1 / lazy_time:,.0f} tx/sec')
+    print(f'Eager decoys: {1 / (lazy_time + decoys * script_time):,.0f} tx/sec')
+
+    sources = []
+    tracemalloc.start()
+    for _ in range(tx_num):
+        generate_tx(sources)
+    lazy_memory = tracemalloc.get_traced_memory()[0]
+    for src in sources:
+        src.script
+    eager_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f'Memory for {tx_num:,} transactions: {lazy_memory / 1024 ** 2:.1f} MiB lazy, '
+          f'{eager_memory / 1024 ** 2:.1f} MiB with every script generated')
+
+
+def bench_mempool(tx_num: int = 50_000, block_size: int = 3_500):
+    txs = _transactions(tx_num)
+    mempool = Mempool(max_bytes=len(txs) * 100)  # about half of them get evicted
+    add_time = _timed(lambda: [mempool.add(tx) for tx in txs], 1)
+    template_time = _timed(lambda: mempool.build_template(block_size), 1)
+    block = mempool.build_template(block_size)
+    reward_time = _timed(lambda: block.reward(include_wrong=True), 10_000)
+    print(f'Mempool add: {tx_num / add_time:,.0f} tx/sec ({len(mempool):,} kept)')
+    print(f'Template of {block_size} from {len(mempool):,}: {template_time * 1000:.1f} ms')
+    print(f'Block.reward: {reward_time * 1e9:.0f} ns')
+
+
+def bench_double_spend(sizes: tuple = (100, 3_500, 20_000), checks: int = 1_000):
+    txs = _transactions(max(sizes) + checks)
+    for size in sizes:
+        block = _block(txs[:size])
+        candidates = txs[size:size + checks]
+
+        def scan():
+            return [any(t.input.tx_id == tx.input.tx_id and t.input.index == tx.input.index
+                        for t in block.transactions) for tx in candidates]
+        scan_time = _timed(scan, 1)
+        set_time = _timed(lambda: [block.conflicts(tx) for tx in candidates], 100)
+        print(f'Block of {size:,}: scanning {scan_time / checks * 1e6:,.1f} us/tx, '
+              f'Block.conflicts {set_time / checks * 1e9:,.0f} ns/tx')
+
+
+def bench_chain(blocks: int = 200, block_size: int = 500):
+    with tempfile.TemporaryDirectory() as tmp:
+        path, db_path = os.path.join(tmp, 'chain.log'), os.path.join(tmp, 'utxo.sqlite3')
+        game = Game(sources=SqliteUtxoStore(db_path))
+        chain = Chain(path, game.sources)
+        append_time = 0.0
+        for nonce in range(blocks):
+            for _ in range(block_size):
+                game.accept(game.new_tx())
+            start = time.perf_counter()
+            game.close_block(chain, nonce)
+            append_time += time.perf_counter() - start
+        chain.close()
+        game.sources.close()
+        print(f'Appended {blocks} blocks of {block_size} (sqlite store): {append_time / blocks * 1000:.2f} ms/block, '
+              f'{os.path.getsize(path) / blocks / 1024:.0f} KiB/block')
+
+        start = time.perf_counter()
+        store = SqliteUtxoStore(db_path)
+        chain = Chain(path, store)  # the store is at the tip, only the index is read
+        sqlite_time = time.perf_counter() - start
+        lookup_time = _timed(lambda: chain.block_at(random.randrange(blocks)), 200)
+        chain.close()
+        store.close()
+        start = time.perf_counter()
+        chain = Chain(path, UtxoSet())  # every block is applied again
+        memory_time = time.perf_counter() - start
+        chain.close()
+        print(f'Startup with the sqlite store: {sqlite_time * 1000:.1f} ms, '
+              f'with a new in-memory store: {memory_time * 1000:.0f} ms')
+        print(f'Chain.block_at: {lookup_time * 1000:.2f} ms')
+
+
+def bench_pipeline(count: int = 50_000, workers: int | None = None):
+    pipeline = Pipeline(workers=workers)
+    try:
+        print(printable(asyncio.run(pipeline.run(count, seed=1))))
+    finally:
+        pipeline.shutdown()
+
+
+def bench_snapshot(size: int = 1_000_000, lookups: int = 10_000):
+    script = generate_arithmetic_script(correct=False)[2:]
+    game = Game(sources=UtxoSet())
+    tx_ids = [generator._random_tx_id() for _ in range(size // 4)]
+    game.sources.extend(TxOutput(tx_ids[i // 4], i % 4, script, 1_000) for i in range(size))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'game.snapshot')
+        snapshot_time = _timed(lambda: snapshot(game, path), 1)
+        start = time.perf_counter()
+        restored = restore(path)
+        restore_time = time.perf_counter() - start
+        wanted = [random.choice(tx_ids) for _ in range(lookups)]
+        lookup_time = _timed(lambda: [restored.source_lookup(t) for t in wanted], 1)
+        restored.sources.close()
+        print(f'Snapshot of {size:,} outputs: {snapshot_time:.1f}s, {os.path.getsize(path) / 1024 ** 2:.0f} MiB')
+        print(f'Restore: {restore_time * 1000:.1f} ms, then {lookup_time / lookups * 1e6:.1f} us per utxo lookup')
+
+
+def bench_server(sessions: int = 1_000, rounds: int = 5):
+    async def run():
+        server = GameServer(port=0)
+        await server.start()
+        try:
+            return await load_test(server.host, server.port, sessions, rounds)
+        finally:
+            await server.stop()
+
+    stats = asyncio.run(run())
+    print(f'{stats["sessions"]} sessions, {stats["commands_per_sec"]:,.0f} commands/sec, '
+          f'p50 {stats["p50_ms"]:.2f} ms, p99 {stats["p99_ms"]:.2f} ms')
+
+
+def bench_metrics_overhead(tx_num: int = 5_000):
+    sources = []
+    disabled_time = _timed(lambda: generate_tx(sources), tx_num)
+    metrics.enable()
+    enabled_time = _timed(lambda: generate_tx(sources), tx_num)
+    metrics.disable()
+    metrics.reset()
+    plain_time = _timed(lambda: generate_tx(sources), tx_num)
+    print(f'generate_tx without metrics: {disabled_time * 1e6:.1f} us, after disabling: {plain_time * 1e6:.1f} us')
+    print(f'generate_tx with metrics:    {enabled_time * 1e6:.1f} us ({enabled_time / disabled_time - 1:+.0%})')
+
+
+
+# Regression check: hot paths in ns per operation (lower is better), compared with a recorded baseline
+#   python -m engine.benchmarks --output results.json --baseline engine/bench_baseline.json
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+DEFAULT_THRESHOLD = 0.5  # 50% slower than the baseline counts as a regression
+RECHECKS = 3  # a path over the threshold is timed again this many times before it counts, noise rarely repeats
+
+
+def _hot_paths() -> dict[str, tuple[Callable, int]]:  # name -> (function, operations per call)
+    scripts = _scripts(1_000)
+    compiled = [CompiledScript(s) for s in scripts]
+    txs = _transactions(3_500)
+    ids = _ids(10_000)
+    encoded = base58.encode_many(ids)
+
+    def opcode_apply():
+        stack = [3, 4]
+        for _ in range(1000):
+            op.dup.apply(stack)
+            op.add.apply(stack)
+
+    paths = {
+        'opcode_apply': (opcode_apply, 2000),
+        'script_apply': (lambda: [apply_script(s) for s in scripts], len(scripts)),
+        'script_compiled': (lambda: [c.evaluate() for c in compiled], len(compiled)),
+        'generate_arithmetic_script': (lambda: generate_arithmetic_script(True), 1),
+        'generate_tx': (lambda: generate_tx([]), 1),
+        'weighed_choice': (lambda: weighed_choice(_ERROR_WEIGHTS), 1),
+    }
+    for size in (1_000, 100_000):
+        game = Game(sources=UtxoSet(_outputs(size)))
+        tx_ids = _lookup_ids(size, 10_000)
+        paths[f'source_lookup_{size}'] = (lambda game=game, tx_ids=tx_ids: [game.source_lookup(t) for t in tx_ids],
+                                          len(tx_ids))
+    for size in (2, 3_500):
+        block = _block(txs[:size])
+        paths[f'block_hash_{size}'] = (lambda block=block: block.hash(12345), 1)
+        paths[f'block_reward_{size}'] = (lambda block=block: block.reward(False), 1)
+    paths['base58_encode'] = (lambda: base58.encode_many(ids), len(ids))
+    paths['base58_decode'] = (lambda: [base58.decode_int(e) for e in encoded], len(encoded))
+    return paths
+
+
+def _reference():  # plain Python that no engine change can speed up or slow down, times how fast the machine is now
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+def _calls_per_run(timer: timeit.Timer) -> int:  # about 20 ms per run, long enough for the timer, short enough
+    # that some runs are not interrupted by other work on the machine
+    number, _ = timer.autorange()  # at least 0.2s
+    return max(number // 10, 1)
+
+
+def _ns_per_op(func: Callable, ops_per_call: int, repeat: int = 20) -> tuple[float, float]:
+    # best of `repeat` runs, for the path and for _reference timed right after each run
+    timer, reference = timeit.Timer(func), timeit.Timer(_reference)
+    number, reference_number = _calls_per_run(timer), _calls_per_run(reference)
+    best, best_reference = float('inf'), float('inf')
+    for _ in range(repeat):
+        best = min(best, timer.timeit(number))
+        best_reference = min(best_reference, reference.timeit(reference_number))
+    return best / number / ops_per_call * 1e9, best_reference / reference_number * 1e9
+
+
+def run_hot_paths(seed: int = 0, runs: int = 1, names: Iterable[str] | None = None) -> dict:
+    # with several runs, the best result of each path (relative to its reference) is kept
+    state = generator.get_state()
+    random.seed(seed)
+    generator.seed(seed)
+    try:
+        paths = _hot_paths()
+    finally:
+        generator.set_state(state)
+    names = list(paths) if names is None else list(names)
+    results, references = {}, {}
+    for _ in range(runs):
+        for name in names:
+            func, ops = paths[name]
+            ns, reference_ns = _ns_per_op(func, ops)
+            if name not in results or ns / reference_ns < results[name] / references[name]:
+                results[name], references[name] = ns, reference_ns
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results_ns': results,
+        'reference_ns': references,  # _reference next to each path, a slower machine is not a regression
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> dict[str, float]:
+    # paths slower than the baseline by more than threshold, relative to _reference -> their slowdown
+    regressions = {}
+    for name, base in baseline['results_ns'].items():
+        now = current['results_ns'].get(name)
+        if now is None:
+            continue
+        machine = current['reference_ns'][name] / baseline.get('reference_ns', {}).get(name, current['reference_ns'][name])
+        slowdown = now / (base * machine) - 1
+        if slowdown > threshold:
+            regressions[name] = slowdown
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Engine hot path benchmarks')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help=f'compare with these results (recorded: {BASELINE_PATH})')
+    parser.add_argument('--runs', type=int, default=1, help='time every path this many times, keep the best result')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='allowed slowdown, 0.5 = 50%%')
+    args = parser.parse_args()
+
+    current = run_hot_paths(runs=args.runs)
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for _ in range(RECHECKS):
+            if len(regressions) == 0:
+                break
+            again = run_hot_paths(names=regressions)
+            for name in regressions:  # the run that is better relative to its own reference
+                if again['results_ns'][name] / again['reference_ns'][name] < \
+                        current['results_ns'][name] / current['reference_ns'][name]:
+                    current['results_ns'][name] = again['results_ns'][name]
+                    current['reference_ns'][name] = again['reference_ns'][name]
+            regressions = compare(current, baseline, args.threshold)
+    for name, ns in current['results_ns'].items():
+        print(f'{name:<32} {ns:>14,.0f} ns')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    for name, slowdown in regressions.items():
+        base = baseline['results_ns'][name]
+        print(f'REGRESSION {name}: {current["results_ns"][name]:,.0f} ns vs {base:,.0f} ns baseline '
+              f'(+{slowdown:.0%} after adjusting for the reference)')
+    if len(regressions) > 0:
+        sys.exit(1)
+
+
+# bench_script_execution()
+# bench_validator()
+# bench_utxo_lookup()
+# bench_sqlite_utxo_store()
+# bench_nonce_search()
+# bench_parallel_nonce_search()
+# bench_block_hash()
+# bench_corpus_generation()
+# bench_weighted_sampling()
+# bench_script_generation()
+# bench_base58()
+# bench_wire_format()
+# bench_script_decoding()
+# bench_utxo_memory()
+# bench_decoy_outputs()
+# bench_mempool()
+# bench_double_spend()
+# bench_chain()
+# bench_pipeline()
+# bench_snapshot()
+# bench_server()
+# bench_metrics_overhead()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+# Append-only log of closed blocks, with an index by height and by hash, that carries UTXO state from block to block
+#   the UTXO store records the last block applied to it (its tip): a new in-memory store gets every block applied
+#   again on startup, a sqlite store keeps outputs and tip between runs, so startup only applies the blocks it missed
+#   log header:   magic | version, so a file that isn't a chain log is refused instead of truncated
+#   log record:   4-byte payload size | CRC-32 of the payload (4) | payload
+#   payload:      hash (20) | previous hash (20) | height | nonce | tx count | transactions
+#                 | spent count | outputs spent by the block (undo data, and the inputs it needs when replayed)
+#   index entry:  offset of the payload (8) | payload size (4) | hash (20), one per height, so startup never parses
+#                 a block - records after the last entry are checked and indexed, only a torn last one is dropped
+import os
+import struct
+import zlib
+from engine import wire
+from engine.structs import GENESIS_HASH, Block, Transaction, TxOutput
+from engine.utxo import UtxoSet, SqliteUtxoStore
+from engine.settings import CHAIN_PATH
+
+MAGIC = b'CMGC'
+VERSION = 1
+HASH_SIZE = 20
+_HEADER = struct.Struct('>4sB')
+_RECORD = struct.Struct('>II')  # payload size, CRC-32
+_ENTRY = struct.Struct(f'>QI{HASH_SIZE}s')
+
+
+def _applies(block: Block, tx: Transaction) -> bool:  # wrong transactions and later double-spends change nothing
+    return tx.error == 'none' and block.spent.get((tx.input.tx_id, tx.input.index)) == tx.tx_id
+
+
+def spent_by(utxos: UtxoSet | SqliteUtxoStore, block: Block) -> list[TxOutput]:
+    # what apply_block would spend, without changing anything - raises KeyError for inputs that don't exist
+    created = {}  # outputs of earlier transactions in the block
+    spent = []
+    for tx in block.transactions:
+        if not _applies(block, tx):
+            continue
+        outpoint = (tx.input.tx_id, tx.input.index)
+        src = utxos.get(*outpoint)
+        if src is None:
+            src = created[outpoint]
+        spent.append(src)
+        created.update(((o.tx_id, o.index), o) for o in tx.outputs)
+    return spent
+
+
+def apply_block(utxos: UtxoSet | SqliteUtxoStore, block: Block, spent_outputs: list[TxOutput] = ()) -> list[TxOutput]:
+    # returns the outputs the block spends - spent_outputs are added first if missing, when replaying into a new store
+    missing = {(src.tx_id, src.index): src for src in spent_outputs}
+    spent = []
+    for tx in block.transactions:
+        if not _applies(block, tx):
+            continue
+        src = utxos.get(tx.input.tx_id, tx.input.index)
+        if src is None:
+            src = missing[(tx.input.tx_id, tx.input.index)]
+            utxos.append(src)
+        spent.append(src)
+        utxos.mark_spent(tx.input.tx_id, tx.input.index)
+        utxos.extend(tx.outputs)
+    return spent
+
+
+def unapply_block(utxos: UtxoSet | SqliteUtxoStore, block: Block):
+    for tx in reversed(block.transactions):
+        if _applies(block, tx):
+            for output in tx.outputs:
+                utxos.remove(output.tx_id, output.index)
+            utxos.mark_spent(tx.input.tx_id, tx.input.index, spent=False)
+
+
+class ChainBlock:
+    __slots__ = ('height', 'block_hash', 'prev_hash', 'nonce', 'block', 'spent_outputs')
+
+    def __init__(self, height: int, block_hash: str, prev_hash: str, nonce: int, block: Block,
+                 spent_outputs: list[TxOutput]):
+        self.height = height
+        self.block_hash = block_hash
+        self.prev_hash = prev_hash
+        self.nonce = nonce
+        self.block = block
+        self.spent_outputs = spent_outputs
+
+
+class Chain:
+    def __init__(self, path: str = CHAIN_PATH, utxos: UtxoSet | SqliteUtxoStore | None = None):
+        # blocks after utxos.tip are applied to it, so it ends up at the tip of the chain
+        self.path = path
+        self.utxos = UtxoSet() if utxos is None else utxos
+        self._offsets: list[tuple[int, int]] = []  # height -> (offset, payload size)
+        self._hashes: list[str] = []  # height -> block hash
+        self._heights: dict[str, int] = {}  # block hash -> height
+        self._log = open(path, 'a+b')
+        self._index = None
+        try:
+            self._check_header()  # before the index is created next to a file that isn't a chain log
+            self._index = open(path + '.idx', 'a+b')
+            self._load_index()
+            self._catch_up()
+        except Exception:
+            self.close()
+            raise
+
+    def _check_header(self):
+        if os.fstat(self._log.fileno()).st_size == 0:
+            self._log.write(_HEADER.pack(MAGIC, VERSION))
+            self._log.flush()
+            return
+        raw = os.pread(self._log.fileno(), _HEADER.size, 0)
+        if len(raw) < _HEADER.size or raw[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{self.path} is not a chain log')
+        _, version = _HEADER.unpack(raw)
+        if version != VERSION:
+            raise ValueError(f'Unsupported chain log version {version} (expected {VERSION})')
+
+    def _load_index(self):
+        self._index.seek(0)
+        raw = self._index.read()
+        raw = raw[:len(raw) - len(raw) % _ENTRY.size]  # a torn last entry is written again below
+        for offset, size, block_hash in _ENTRY.iter_unpack(raw):
+            self._remember(offset, size, block_hash.hex())
+        log_size = os.fstat(self._log.fileno()).st_size
+        while len(self._offsets) > 0 and self._end() > log_size:  # the index got ahead of the log
+            self._forget()
+        indexed = len(self._offsets)
+        end = self._end()
+        while end + _RECORD.size <= log_size:  # records written after the last index entry
+            size, checksum = _RECORD.unpack(os.pread(self._log.fileno(), _RECORD.size, end))
+            start = end + _RECORD.size
+            if start + size > log_size:
+                break
+            payload = os.pread(self._log.fileno(), size, start)
+            if zlib.crc32(payload) != checksum or size < 2 * HASH_SIZE:
+                if start + size == log_size:  # the last record, torn while it was written
+                    break
+                raise ValueError(f'Corrupt record at byte {end} of {self.path}')
+            self._remember(start, size, payload[:HASH_SIZE].hex())
+            end = self._end()
+        self._log.truncate(end)  # drops a torn last record, everything before it was checked
+        self._index.truncate(indexed * _ENTRY.size)
+        missing = zip(self._offsets[indexed:], self._hashes[indexed:])
+        self._index.write(b''.join(_ENTRY.pack(o, s, bytes.fromhex(h)) for (o, s), h in missing))
+        self._index.flush()
+
+    def _catch_up(self):
+        tip = self.utxos.tip
+        if tip != GENESIS_HASH and tip not in self._heights:
+            raise ValueError(f'The UTXO store is at block {tip}, which is not in {self.path}')
+        for height in range(self._heights.get(tip, -1) + 1, len(self._offsets)):
+            entry = self.block_at(height)
+            apply_block(self.utxos, entry.block, entry.spent_outputs)
+            self.utxos.tip = entry.block_hash
+
+    def _end(self) -> int:  # where the next record goes
+        if len(self._offsets) == 0:
+            return _HEADER.size
+        offset, size = self._offsets[-1]
+        return offset + size
+
+    def _remember(self, offset: int, size: int, block_hash: str):
+        self._heights[block_hash] = len(self._hashes)
+        self._offsets.append((offset, size))
+        self._hashes.append(block_hash)
+
+    def _forget(self):
+        self._offsets.pop()
+        del self._heights[self._hashes.pop()]
+
+    @property
+    def height(self) -> int:  # -1 for an empty chain
+        return len(self._hashes) - 1
+
+    @property
+    def tip_hash(self) -> str:
+        return self._hashes[-1] if len(self._hashes) > 0 else GENESIS_HASH
+
+    def append(self, block: Block, nonce: int) -> str:  # returns the block hash
+        if block.prev_hash != self.tip_hash:
+            raise ValueError(f'Block builds on {block.prev_hash}, but the tip is {self.tip_hash}')
+        block_hash = block.hash(nonce)
+        if block_hash in self._heights:
+            raise ValueError(f'Block {block_hash} is already in the chain')
+        spent = spent_by(self.utxos, block)
+        payload = bytearray(bytes.fromhex(block_hash) + bytes.fromhex(block.prev_hash))
+        wire.write_varint(payload, self.height + 1)
+        wire.write_varint(payload, nonce)
+        wire.write_varint(payload, len(block.transactions))
+        for tx in block.transactions:
+            wire.write_transaction(payload, tx)
+        wire.write_varint(payload, len(spent))
+        for src in spent:
+            wire.write_output(payload, src)
+        offset = self._end() + _RECORD.size
+        # log first, a missing index entry is rebuilt on startup
+        self._log.write(_RECORD.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._log.flush()
+        self._index.write(_ENTRY.pack(offset, len(payload), bytes.fromhex(block_hash)))
+        self._index.flush()
+        self._remember(offset, len(payload), block_hash)
+        apply_block(self.utxos, block)  # last - a store left behind by a crash catches up on startup
+        self.utxos.tip = block_hash
+        return block_hash
+
+    def pop(self) -> ChainBlock:  # removes the tip and undoes its UTXO changes
+        if len(self._hashes) == 0:
+            raise IndexError('The chain is empty')
+        tip = self.block_at(self.height)
+        unapply_block(self.utxos, tip.block)
+        self.utxos.tip = tip.prev_hash
+        self._forget()
+        self._index.truncate(len(self._offsets) * _ENTRY.size)
+        self._index.flush()
+        self._log.truncate(self._end())
+        self._log.flush()
+        return tip
+
+    def rewind(self, height: int) -> list[ChainBlock]:  # pops blocks until `height` is the tip, tip first
+        return [self.pop() for _ in range(self.height - height)]
+
+    def block_at(self, height: int) -> ChainBlock:
+        if not 0 <= height < len(self._offsets):
+            raise IndexError(f'No block at height {height}')
+        offset, size = self._offsets[height]
+        raw = os.pread(self._log.fileno(), _RECORD.size + size, offset - _RECORD.size)
+        size_, checksum = _RECORD.unpack_from(raw, 0)
+        buf = memoryview(raw)[_RECORD.size:]
+        if size_ != size or len(buf) != size or zlib.crc32(buf) != checksum:
+            raise ValueError(f'Block at height {height} of {self.path} is corrupt')
+        block_hash = buf[:HASH_SIZE].hex()
+        prev_hash = buf[HASH_SIZE:2 * HASH_SIZE].hex()
+        pos = 2 * HASH_SIZE
+        height_, pos = wire.read_varint(buf, pos)
+        nonce, pos = wire.read_varint(buf, pos)
+        tx_num, pos = wire.read_varint(buf, pos)
+        block = Block(prev_hash)
+        for _ in range(tx_num):
+            tx, pos = wire.read_transaction(buf, pos)
+            block.add(tx)
+        spent_num, pos = wire.read_varint(buf, pos)
+        spent = []
+        for _ in range(spent_num):
+            src, pos = wire.read_output(buf, pos)
+            spent.append(src)
+        return ChainBlock(height_, block_hash, prev_hash, nonce, block, spent)
+
+    def block_by_hash(self, block_hash: str) -> ChainBlock:  # raises KeyError for unknown hashes
+        return self.block_at(self._heights[block_hash])
+
+    def __contains__(self, block_hash: str) -> bool:
+        return block_hash in self._heights
+
+    def close(self):
+        self._log.close()
+        if self._index is not None:
+            self._index.close()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
@@ -0,0 +1,49 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+from engine import generator, wire
+from engine.structs import Transaction, TxOutput
+
+
+def chunk_seed(seed: int, chunk_index: int) -> int:  # independent of the number of workers
+    return random.Random(f'{seed}:{chunk_index}').getrandbits(64)
+
+
+def generate_chunk(seed: int, chunk_index: int, size: int,
+                   errors: dict[str, int] | None = None) -> tuple[list[Transaction], list[TxOutput]]:
+    state = generator.get_state()  # the caller's seed carries on after the chunk
+    generator.seed(chunk_seed(seed, chunk_index))
+    try:
+        sources = []
+        txs = [generator.generate_tx(sources, errors) for _ in range(size)]
+    finally:
+        generator.set_state(state)
+    return txs, sources
+
+
+def generate_batches(count: int, seed: int, batch_size: int = 10_000,
+                     errors: dict[str, int] | None = None) -> Iterator[tuple[list[Transaction], list[TxOutput]]]:
+    for chunk_index, start in enumerate(range(0, count, batch_size)):
+        yield generate_chunk(seed, chunk_index, min(batch_size, count - start), errors)
+
+
+def encoded_chunk(seed: int, chunk_index: int, size: int, errors: dict[str, int] | None) -> bytes:
+    # runs in a worker process - OpCode bodies can't be pickled, so the chunk is sent back already encoded
+    txs, sources = generate_chunk(seed, chunk_index, size, errors)
+    return wire.encode_records(sources + txs)
+
+
+def write_corpus(path: str, count: int, seed: int, workers: int | None = None, batch_size: int = 10_000,
+                 errors: dict[str, int] | None = None) -> float:  # returns transactions per second
+    # each chunk has its own seed, so the file is the same for any number of workers - read it with wire.read_records
+    workers = workers or os.cpu_count() or 1
+    sizes = [min(batch_size, count - start) for start in range(0, count, batch_size)]
+    start = time.perf_counter()
+    with open(path, 'wb') as f, ProcessPoolExecutor(workers) as pool:
+        chunks = pool.map(encoded_chunk, [seed] * len(sizes), range(len(sizes)), sizes, [errors] * len(sizes))
+        for chunk in chunks:
+            f.write(chunk)
+    elapsed = time.perf_counter() - start
+    return count / elapsed if elapsed > 0 else float('inf')
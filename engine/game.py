@@ -1,9 +1,15 @@
 from engine.structs import Transaction, Block, TxOutput
-from engine import generator
+from engine.utxo import UtxoSet, SqliteUtxoStore, open_utxo_store
+from engine.chain import Chain
+from engine.validator import Validator
+import time
+from engine import generator, metrics
 from engine.settings import *
 
 
 class Result:
+    __slots__ = ('tx', 'accepted', 'correct', 'message')
+
     def __init__(self, tx: Transaction, accepted: bool):
         self.tx = tx
         self.accepted = accepted
@@ -16,25 +22,81 @@ class Result:
         return f'Transaction {self.tx.tx_id}: <i>{wrongly} {decision}</i> - <b>{self.message}</b>'
 
 class Game:
-    block = Block()
-    rejected_tx: list[Transaction] = []
-    sources: list[TxOutput] = []
-    results: list[Result] = []
+    def __init__(self, sources: UtxoSet | SqliteUtxoStore | None = None):
+        self.block = Block()
+        self.rejected_tx: list[Transaction] = []
+        self.sources = open_utxo_store() if sources is None else sources  # by default depends on UTXO_STORE
+        self.results: list[Result] = []
+        self.validator = Validator(self.sources)  # script results are cached across all games
+        self.marked: dict[str, tuple[str, int]] = {}  # tx_id -> output it marked as spent, undone by reject/reset
+
+    def validate(self, tx: Transaction) -> str:  # the error label a perfect player would find
+        return self.validator.validate(tx)
 
     def accept(self, tx: Transaction):
-        self.block.transactions.append(tx)
+        self._mark(tx.tx_id, (tx.input.tx_id, tx.input.index))  # a double-spend in this block finds it spent already
+        self.block.add(tx)
         self.results.append(Result(tx, True))
 
-    def reject(self, tx: Transaction):
+    def reject(self, tx: Transaction):  # also takes back an accepted transaction
+        if tx.tx_id in self.block:
+            outpoint = (tx.input.tx_id, tx.input.index)
+            self._unmark(tx.tx_id)
+            self.block.remove(tx)
+            spender = self.block.spent.get(outpoint)
+            if spender is not None:  # a later double-spend is the first spender now
+                self._mark(spender, outpoint)
+            self.results = [r for r in self.results if r.tx.tx_id != tx.tx_id]
         self.rejected_tx.append(tx)
         self.results.append(Result(tx, False))
 
+    def reset(self):  # back to an empty block, outputs spent by it are unspent again
+        self._unmark_all()
+        self.block = Block(self.block.prev_hash)
+        self.rejected_tx = []
+        self.results = []
+
+    def next_block(self, prev_hash: str):  # like reset, but what the block spent stays spent, the next one builds on it
+        self.marked.clear()
+        self.block.prev_hash = prev_hash
+        self.reset()
+
+    def close_block(self, chain: Chain, nonce: int) -> str:  # chain.utxos has to be self.sources
+        self._unmark_all()  # only correct transactions really spend their inputs, the chain marks those again
+        block_hash = chain.append(self.block, nonce)
+        self.block.prev_hash = block_hash  # the next block starts on top of this one
+        self.reset()
+        return block_hash
+
+    def end(self):  # the open block never reaches a chain, so a persistent store must not keep what it marked
+        self._unmark_all()
+
+    def _mark(self, tx_id: str, outpoint: tuple[str, int]):
+        src = self.sources.get(*outpoint)
+        if src is not None and not src.spent:
+            self.sources.mark_spent(*outpoint)
+            self.marked[tx_id] = outpoint
+
+    def _unmark(self, tx_id: str):
+        outpoint = self.marked.pop(tx_id, None)
+        if outpoint is not None:
+            self.sources.mark_spent(*outpoint, spent=False)
+
+    def _unmark_all(self):
+        for tx_id in list(self.marked):
+            self._unmark(tx_id)
+
     def new_tx(self) -> Transaction:
         return generator.generate_tx(self.sources)
 
     def source_lookup(self, tx_id: str) -> list[TxOutput]:
-        res = filter(lambda src: src.tx_id == tx_id, self.sources)
-        return sorted(res, key=lambda src: src.index)
+        if not metrics.enabled:
+            return self.sources.lookup(tx_id)
+        start = time.perf_counter()
+        res = self.sources.lookup(tx_id)
+        metrics.inc('utxo_lookups_total', found='true' if len(res) > 0 else 'false')
+        metrics.inc('utxo_lookup_seconds_total', time.perf_counter() - start)
+        return res
 
     def result_summary(self) -> dict:  # True = correct
         res = {True: 0, False: 0}
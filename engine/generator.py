@@ -2,12 +2,30 @@ import math
 import random
 import secrets
 from engine import op, base58
-from engine.structs import OpX, OpCode, OpPushBytes, TxInput, TxOutput, Transaction
+from engine.structs import OpCode, TxIO, TxInput, TxOutput, Transaction
+from engine.sampling import Sampler, UpdatableSampler
+from engine.utxo import UtxoSet, SqliteUtxoStore
 from engine.settings import *
 
+_rng = random.Random()
+_reproducible = False
+
+def seed(value: int | str | None = None):  # fixed seed makes generation reproducible, None restores the default
+    global _reproducible
+    _rng.seed(value)  # reseeded in place, samplers below keep a reference to it
+    _reproducible = value is not None
+
+def get_state() -> tuple:  # for callers that reseed for a while, see set_state
+    return _rng.getstate(), _reproducible
+
+def set_state(state: tuple):
+    global _reproducible
+    rng_state, _reproducible = state
+    _rng.setstate(rng_state)
+
 def weighed_choice(options: dict):
     total = sum(options.values())
-    r = random.randint(1, total)
+    r = _rng.randint(1, total)
     upto = 0
     for o, w in options.items():
         upto += w
@@ -16,16 +34,16 @@ def weighed_choice(options: dict):
     assert False, "weighed_choice failed to pick an option"
 
 def yes_or_no(percent_chance: int) -> bool:
-    return random.randint(1, 100) <= percent_chance
+    return _rng.randint(1, 100) <= percent_chance
 
 ############################# SCRIPT ###################################
 
 def _random_offset(base_value: int, down: int, up: int, avoid_base: bool = True) -> int:
     lowest = max(base_value + down, -1)
     highest = min(base_value + up, 127)
-    rand = random.randint(lowest, highest)
+    rand = _rng.randint(lowest, highest)
     while rand == base_value and avoid_base:
-        rand = random.randint(lowest, highest)
+        rand = _rng.randint(lowest, highest)
     return rand
 
 
@@ -68,6 +86,28 @@ _finishers = {
     op.lessthanorequal: 1,
 }
 
+_finisher_sampler = Sampler(_finishers, _rng)
+
+_steps = {'reduce': _reductions, 'keep': _neutrals, 'expand': _expansions}
+
+def _consumed(operation: OpCode | int) -> int:  # 0 stands for a new number, which needs nothing on the stack
+    return 0 if operation == 0 else operation.stack_effect[0]
+
+_MAX_CONSUMED = max(_consumed(o) for options in _steps.values() for o in options)
+
+def _legal_samplers(depth: int) -> tuple[dict[str, float], dict[str, Sampler]]:
+    # per step: the share of its weight that is legal with `depth` items on the stack, and a sampler of just those
+    factors, samplers = {}, {}
+    for step, options in _steps.items():
+        legal = {o: w for o, w in options.items() if _consumed(o) <= depth}
+        factors[step] = sum(legal.values()) / sum(options.values())
+        samplers[step] = Sampler(legal, _rng)
+    return factors, samplers
+
+# the loop below always has at least 2 items, from _MAX_CONSUMED up everything is legal
+_samplers_by_depth = {depth: _legal_samplers(depth) for depth in range(2, _MAX_CONSUMED)}
+_all_samplers = _legal_samplers(_MAX_CONSUMED)[1]
+
 
 def get_last_item(result: int, finisher: OpCode, correct: bool) -> int:
     if (finisher.name == 'OP_NUMEQUAL' and correct) or (finisher.name == 'OP_NUMNOTEQUAL' and not correct):
@@ -85,38 +125,38 @@ def get_last_item(result: int, finisher: OpCode, correct: bool) -> int:
     else:
         raise ValueError(f'Unknown finisher: {finisher}')
 
-def generate_arithmetic_script(correct: bool) -> list[OpCode]:  # if correct is False, the script should fail the verification
+def _arithmetic_operations() -> tuple[list[OpCode], int]:  # (instructions, the single number they leave)
     instructions = []
     stack = []
-    strategy = {'reduce': 0, 'keep': SCRIPT_LENGTH, 'expand': 2 * SCRIPT_LENGTH}
+    strategy = UpdatableSampler({'reduce': 0, 'keep': SCRIPT_LENGTH, 'expand': 2 * SCRIPT_LENGTH}, _rng)
     for _ in range(2):  # two starting items
-        starting_item = random.randint(-1, 16)
-        instructions.append(OpX(starting_item))
+        starting_item = _rng.randint(-1, 16)
+        instructions.append(op.push_number(starting_item))
         stack.append(starting_item)
     while len(stack) > 1:
-        step = weighed_choice(strategy)
-        if step == 'reduce':
-            operation = weighed_choice(_reductions)
-        elif step == 'expand':
-            operation = weighed_choice(_expansions)
-            if operation == 0:
-                item = random.randint(-1, 16)
-                operation = OpX(item)
-        else:
-            operation = weighed_choice(_neutrals)
-
-        try:
-            operation.apply(stack)
-            instructions.append(operation)
-            if strategy['expand'] > 1:  # the longer we go, the lower the chance of expansion
-                strategy['expand'] -= 1
-                strategy['reduce'] += 1
-        except (ValueError, IndexError):
-            # print(f'W | Operation {operation} not added: {e}')
-            pass
-    result = stack[0]
-
-    finisher = weighed_choice(_finishers)
+        if len(stack) >= _MAX_CONSUMED:
+            step = strategy.draw()
+            operation = _all_samplers[step].draw()
+        else:  # only operations with enough items on the stack are drawn, with the same odds as
+            # drawing from everything and retrying the ones that do not fit
+            factors, samplers = _samplers_by_depth[len(stack)]
+            step = strategy.draw_scaled(factors)
+            operation = samplers[step].draw()
+        if operation == 0:
+            item = _rng.randint(-1, 16)
+            operation = op.push_number(item)
+
+        operation.apply(stack)
+        instructions.append(operation)
+        if strategy.weights['expand'] > 1:  # the longer we go, the lower the chance of expansion
+            strategy.update('expand', -1)
+            strategy.update('reduce', 1)
+    return instructions, stack[0]
+
+def generate_arithmetic_script(correct: bool) -> list[OpCode]:  # if correct is False, the script should fail the verification
+    instructions, result = _arithmetic_operations()
+
+    finisher = _finisher_sampler.draw()
     precise_finisher = finisher.name in ('OP_NUMEQUAL', 'OP_NUMNOTEQUAL')
     if result < -1 or (result == -1 and not precise_finisher):  # we don't like negative numbers - negate those
         instructions.append(op.negate)
@@ -124,9 +164,9 @@ def generate_arithmetic_script(correct: bool) -> list[OpCode]:  # if correct is
     if 0 <= result <= 126 or (precise_finisher and result in (-1, 127)):  # leaving -1 and 127 as margins for < or >
         last_item = get_last_item(result, finisher, correct)
         if -1 <= last_item <= 16:
-            instructions.append(OpX(last_item))
+            instructions.append(op.push_number(last_item))
         else:
-            instructions.append(OpPushBytes(hex(last_item)[2:]))
+            instructions.append(op.push_bytes(hex(last_item)[2:]))
     else:  # result is outside the safe range, we just verify it
         if not correct:
             instructions.append(op.not_)  # result will never be zero, so we have to OP_NOT it if not correct
@@ -144,8 +184,11 @@ _errors = {
     'invalid_input': 1,
     'already_spent': 1,
 }
+_error_sampler = Sampler(_errors, _rng)
 
 def _random_sha1() -> str:
+    if _reproducible:
+        return _rng.randbytes(32).hex()
     return secrets.token_hex(32)
 
 def _random_tx_id() -> str:
@@ -153,45 +196,74 @@ def _random_tx_id() -> str:
 
 def _generate_valid_io_pair(script_ok: bool) -> tuple[TxOutput, TxInput]:  # (external output, our input)
     script = generate_arithmetic_script(script_ok)
-    amount = random.randint(10, 2_500) * (10 ** random.randint(1, 5))
+    amount = _rng.randint(10, 2_500) * (10 ** _rng.randint(1, 5))
     tx_id = _random_tx_id()
-    index = random.randint(0, 4)
+    index = _rng.randint(0, 4)
     a = TxOutput(tx_id, index, script[2:], amount)
     b = TxInput(tx_id, index, script[:2])
     return a, b
 
+def decoy_script(seed: int) -> list[OpCode]:  # the same seed always gives the same failing script
+    state = _rng.getstate()  # the shared generator continues as if nothing happened
+    _rng.seed(seed)
+    try:
+        return generate_arithmetic_script(correct=False)[2:]
+    finally:
+        _rng.setstate(state)
+
+class DecoyOutput(TxOutput):  # most decoys are never looked at, so the script is only generated when used
+    __slots__ = ('seed',)
+    _script = TxIO.script  # the slot behind the property
+
+    def __init__(self, tx_id: str, index: int, seed: int, amount: int):
+        self.seed = seed
+        super().__init__(tx_id, index, None, amount)
+
+    @property
+    def script(self) -> list[OpCode]:
+        script = DecoyOutput._script.__get__(self)
+        if script is None:
+            script = decoy_script(self.seed)
+            DecoyOutput._script.__set__(self, script)
+        return script
+
+    @script.setter
+    def script(self, script: list[OpCode] | None):
+        DecoyOutput._script.__set__(self, script)
+
 def _generate_fake_sources(tx_id: str, real_index: int) -> list[TxOutput]:  # no-op for real_index<=0
     ret: list[TxOutput] = []
-    indices_after = random.randint(0, 2)
+    indices_after = _rng.randint(0, 2)
     fake_indices = range(0, real_index + indices_after)
     for i in fake_indices:
         if i == real_index:
             continue
-        script = generate_arithmetic_script(correct=False)[2:]
-        amount = random.randint(10, 2_500) * (10 ** random.randint(1, 5))
-        out = TxOutput(tx_id, i, script, amount)
+        seed = _rng.getrandbits(64)
+        amount = _rng.randint(10, 2_500) * (10 ** _rng.randint(1, 5))
+        out = DecoyOutput(tx_id, i, seed, amount)
         out.spent = yes_or_no(30)
         ret.append(out)
     return ret
 
 def _divide(total: int) -> list[int]:
-    divisions = random.randint(1, 4)
+    divisions = _rng.randint(1, 4)
     ends = [total]
     for _ in range(divisions - 1):
-        new_end = random.randint(0, total)
+        new_end = _rng.randint(0, total)
         ends.append(new_end)
     ends.sort()
     for i in range(divisions - 1, 0, -1):
         ends[i] -= ends[i - 1]
     return ends
 
+_output_script = [op.verify]  # scripts are never modified, so all outputs share this one
+
 def _generate_output(index: int, amount: int) -> TxOutput:
     tx_id = _random_tx_id()
-    script = [op.verify]
-    return TxOutput(tx_id, index, script, amount)
+    return TxOutput(tx_id, index, _output_script, amount)
 
-def generate_tx(source_list: list[TxOutput]) -> Transaction:
-    error = weighed_choice(_errors)
+def generate_tx(source_list: list[TxOutput] | UtxoSet | SqliteUtxoStore, errors: dict[str, int] | None = None) -> Transaction:
+    error = (_error_sampler if errors is None else Sampler(errors, _rng)).draw()
     script_ok = error != 'script_failed'
     src, inp = _generate_valid_io_pair(script_ok=script_ok)
     if error != 'invalid_input' or yes_or_no(50):  # always if not invalid input, 50% chance otherwise
@@ -202,9 +274,9 @@ def generate_tx(source_list: list[TxOutput]) -> Transaction:
         source_list.append(src)
     amount = src.amount
     if error == 'negative_fee':
-        fee_factor = .01 * random.randint(-20, -5)
+        fee_factor = .01 * _rng.randint(-20, -5)
     else:
-        fee_factor = .01 * random.randint(10, 50)
+        fee_factor = .01 * _rng.randint(10, 50)
     fee = math.ceil(fee_factor * amount)
     netto = amount - fee
     output_amounts = _divide(netto)
@@ -0,0 +1,87 @@
+import heapq
+import itertools
+from engine.structs import GENESIS_HASH, Block, Transaction
+from engine.wire import transaction_size
+
+
+def tx_size(tx: Transaction) -> int:  # bytes in the wire format, counted rather than encoded
+    return transaction_size(tx)
+
+
+def fee_priority(tx: Transaction, size: int) -> float:
+    return tx.fee
+
+
+def fee_rate_priority(tx: Transaction, size: int) -> float:  # satoshis per byte, like real miners
+    return tx.fee / size
+
+
+class Mempool:  # pending transactions in a min-heap by priority, so the cheapest is always the first evicted
+    def __init__(self, max_bytes: int | None = None, priority=fee_priority):
+        self.max_bytes = max_bytes
+        self.priority = priority
+        self._heap: list[list] = []  # [priority, sequence, tx, size], tx is None once removed
+        self._entries: dict[str, list] = {}
+        self._sequence = itertools.count()
+        self.bytes = 0
+        self.total_fee = 0
+
+    def add(self, tx: Transaction) -> list[Transaction]:  # returns transactions evicted to stay under max_bytes
+        if tx.tx_id in self._entries:
+            return []
+        size = tx_size(tx)
+        entry = [self.priority(tx, size), next(self._sequence), tx, size]
+        heapq.heappush(self._heap, entry)
+        self._entries[tx.tx_id] = entry
+        self.bytes += size
+        self.total_fee += tx.fee
+        evicted = []
+        while self.max_bytes is not None and self.bytes > self.max_bytes:
+            evicted.append(self._pop_lowest())
+        return evicted
+
+    def _pop_lowest(self) -> Transaction:
+        while True:
+            entry = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                self._forget(entry)
+                return entry[2]
+
+    def _forget(self, entry: list):
+        del self._entries[entry[2].tx_id]
+        self.bytes -= entry[3]
+        self.total_fee -= entry[2].fee
+
+    def remove(self, tx_id: str) -> Transaction | None:
+        entry = self._entries.get(tx_id)
+        if entry is None:
+            return None
+        tx = entry[2]
+        self._forget(entry)
+        entry[2] = None  # lazily dropped from the heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [e for e in self._heap if e[2] is not None]
+            heapq.heapify(self._heap)
+        return tx
+
+    def remove_block(self, block: Block):  # once the block is mined, its transactions are not pending anymore
+        for tx in block.transactions:
+            self.remove(tx.tx_id)
+
+    def best(self, max_tx: int) -> list[Transaction]:  # highest priority first, O(n log max_tx)
+        live = (e for e in self._heap if e[2] is not None)
+        return [e[2] for e in heapq.nlargest(max_tx, live, key=lambda e: (e[0], -e[1]))]
+
+    def build_template(self, max_tx: int = 3_500, prev_hash: str = GENESIS_HASH) -> Block:
+        # the mempool is left as is, see remove_block
+        block = Block(prev_hash)
+        for tx in self.best(max_tx):
+            if not block.conflicts(tx):  # a better-paying transaction already spends its input
+                block.add(tx)
+        return block
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,60 @@
+import hashlib
+
+EMPTY_ROOT = bytes(20)
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha1(left + right).digest()
+
+
+def leaf_hash(tx_id: str) -> bytes:
+    return hashlib.sha1(tx_id.encode('ascii')).digest()
+
+
+class MerkleTree:  # append-only, an odd node at the end of a level is paired with itself (like in Bitcoin)
+    def __init__(self):
+        self.levels: list[list[bytes]] = [[]]  # levels[0] are the leaves, levels[-1] is the root
+
+    def append(self, leaf: bytes):  # updates only the rightmost path, O(log n)
+        levels = self.levels
+        levels[0].append(leaf)
+        position = len(levels[0]) - 1
+        level = 0
+        while len(levels[level]) > 1:
+            nodes = levels[level]
+            left_position = position & ~1
+            left = nodes[left_position]
+            right = nodes[left_position + 1] if left_position + 1 < len(nodes) else left
+            position //= 2
+            level += 1
+            if level == len(levels):
+                levels.append([])
+            parent = _node(left, right)
+            if position < len(levels[level]):
+                levels[level][position] = parent
+            else:
+                levels[level].append(parent)
+
+    def root(self) -> bytes:
+        if len(self.levels[0]) == 0:
+            return EMPTY_ROOT
+        return self.levels[-1][0]
+
+    def proof(self, position: int) -> list[tuple[bytes, bool]]:  # (sibling, sibling_is_left) from leaf to root
+        path = []
+        for nodes in self.levels[:-1]:
+            sibling_position = position ^ 1
+            sibling = nodes[sibling_position] if sibling_position < len(nodes) else nodes[position]
+            path.append((sibling, sibling_position < position))
+            position //= 2
+        return path
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+
+def verify_proof(tx_id: str, proof: list[tuple[bytes, bool]], root: bytes) -> bool:
+    node = leaf_hash(tx_id)
+    for sibling, sibling_is_left in proof:
+        node = _node(sibling, node) if sibling_is_left else _node(node, sibling)
+    return node == root
@@ -0,0 +1,79 @@
+# Opt-in counters for the engine hot paths, off by default - call enable() first
+import json
+import time
+from engine.structs import OpCode
+
+PREFIX = 'cryptominer_'
+_HELP = {
+    'opcode_executions_total': ('counter', 'OpCode.apply calls'),
+    'opcode_seconds_total': ('counter', 'Time spent in OpCode.apply'),
+    'utxo_lookups_total': ('counter', 'Game.source_lookup calls'),
+    'utxo_lookup_seconds_total': ('counter', 'Time spent in Game.source_lookup'),
+    'nonce_hashes_total': ('counter', 'Hashes computed by nonce searches'),
+    'nonce_search_seconds_total': ('counter', 'Time spent in nonce searches'),
+    'nonce_hashrate': ('gauge', 'Hashes per second of the last nonce search'),
+}
+
+enabled = False  # checked by the instrumented code, so disabled metrics cost one global lookup
+_values: dict[tuple[str, tuple], float] = {}
+_plain_apply = OpCode.apply
+
+
+def _timed_apply(self: OpCode, stack: list):
+    start = time.perf_counter()
+    try:
+        _plain_apply(self, stack)
+    finally:
+        labels = (('opcode', self.name),)
+        _values[('opcode_executions_total', labels)] = _values.get(('opcode_executions_total', labels), 0) + 1
+        elapsed = time.perf_counter() - start
+        _values[('opcode_seconds_total', labels)] = _values.get(('opcode_seconds_total', labels), 0) + elapsed
+
+
+def enable():
+    global enabled
+    enabled = True
+    OpCode.apply = _timed_apply  # swapped, not checked per call - the plain apply stays as fast as before
+
+
+def disable():
+    global enabled
+    enabled = False
+    OpCode.apply = _plain_apply
+
+
+def reset():
+    _values.clear()
+
+
+def inc(name: str, amount: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    _values[(name, tuple(sorted(labels.items())))] = value
+
+
+def snapshot() -> dict[str, list[dict]]:  # {metric: [{'labels': {...}, 'value': ...}]}
+    res = {}
+    for (name, labels), value in sorted(_values.items()):
+        res.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+    return res
+
+
+def to_json() -> str:
+    return json.dumps({'timestamp': time.time(), 'metrics': snapshot()})
+
+
+def to_prometheus() -> str:  # text exposition format
+    lines = []
+    for name, samples in snapshot().items():
+        kind, help_ = _HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {PREFIX}{name} {help_}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        for sample in samples:
+            labels = ','.join(f'{k}="{v}"' for k, v in sample['labels'].items())
+            labels = '{' + labels + '}' if labels else ''
+            lines.append(f'{PREFIX}{name}{labels} {sample["value"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,138 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from engine import metrics
+from engine.structs import Block
+from engine.settings import ZEROS_REQUIRED
+
+MAX_NONCE = 2 ** 32
+_DIGEST_BITS = 160  # sha1
+
+
+def target_for_bits(zero_bits: int) -> bytes:  # digests lower than this start with zero_bits zero bits
+    return (1 << (_DIGEST_BITS - zero_bits)).to_bytes(_DIGEST_BITS // 8, 'big')
+
+
+def target_for_zeros(zeros: int = ZEROS_REQUIRED) -> bytes:  # zeros in the hex digest, as in Block.hash
+    return target_for_bits(4 * zeros)
+
+
+def record_search(hashes: int, elapsed: float):
+    metrics.inc('nonce_hashes_total', hashes)
+    metrics.inc('nonce_search_seconds_total', elapsed)
+    if elapsed > 0:
+        metrics.set_gauge('nonce_hashrate', hashes / elapsed)
+
+
+class NonceSearch:  # hashes the block's header prefix once, then only the nonce for every attempt
+    def __init__(self, block: Block, target: bytes | None = None):
+        self.midstate = hashlib.sha1(block.header_prefix())
+        self.target = target_for_zeros() if target is None else target
+
+    @classmethod
+    def from_prefix(cls, prefix: bytes, target: bytes | None = None) -> 'NonceSearch':
+        search = cls.__new__(cls)
+        search.midstate = hashlib.sha1(prefix)
+        search.target = target_for_zeros() if target is None else target
+        return search
+
+    def digest(self, nonce: int) -> bytes:
+        sha1 = self.midstate.copy()
+        sha1.update(b'%d' % nonce)
+        return sha1.digest()
+
+    def meets_target(self, nonce: int) -> bool:
+        return self.digest(nonce) < self.target
+
+    def search(self, start: int = 0, stop: int = MAX_NONCE) -> int | None:
+        if metrics.enabled:
+            begin = time.perf_counter()
+            nonce = self._search(start, stop)
+            record_search(stop - start if nonce is None else nonce - start + 1, time.perf_counter() - begin)
+            return nonce
+        return self._search(start, stop)
+
+    def _search(self, start: int, stop: int) -> int | None:
+        copy = self.midstate.copy
+        target = self.target
+        for nonce in range(start, stop):
+            sha1 = copy()
+            sha1.update(b'%d' % nonce)
+            if sha1.digest() < target:
+                return nonce
+        return None
+
+
+class SearchResult:
+    def __init__(self, nonce: int | None, hashes: int, elapsed: float, workers: int):
+        self.nonce = nonce
+        self.hashes = hashes
+        self.elapsed = elapsed
+        self.workers = workers
+
+    @property
+    def hashrate(self) -> float:
+        return self.hashes / self.elapsed if self.elapsed > 0 else float('inf')
+
+    def printable(self) -> str:
+        found = f'nonce={self.nonce}' if self.nonce is not None else 'no nonce'
+        return f'Found {found} after {self.hashes:,} hashes in {self.elapsed:.3f}s ({self.hashrate:,.0f} H/s on {self.workers} workers)'
+
+
+def search_prefix(prefix: bytes, target: bytes | None = None, start: int = 0, stop: int = MAX_NONCE) -> SearchResult:
+    # single process search that only needs picklable arguments, for executors
+    begin = time.perf_counter()
+    nonce = NonceSearch.from_prefix(prefix, target).search(start, stop)
+    hashes = stop - start if nonce is None else nonce - start + 1
+    return SearchResult(nonce, hashes, time.perf_counter() - begin, 1)
+
+
+_cancel = None  # set by any worker that finds a nonce, checked by all of them between chunks
+
+
+def _init_worker(cancel):
+    global _cancel
+    _cancel = cancel
+
+
+def _scan(prefix: bytes, target: bytes, first: int, step: int, stop: int, chunk: int) -> tuple[int | None, int]:
+    search = NonceSearch.from_prefix(prefix, target)
+    hashes = 0
+    for chunk_start in range(first, stop, step):
+        if _cancel.is_set():
+            break
+        chunk_stop = min(chunk_start + chunk, stop)
+        nonce = search.search(chunk_start, chunk_stop)
+        if nonce is not None:
+            _cancel.set()
+            return nonce, hashes + nonce - chunk_start + 1
+        hashes += chunk_stop - chunk_start
+    return None, hashes
+
+
+def parallel_search(block: Block, workers: int | None = None, target: bytes | None = None,
+                    stop: int = MAX_NONCE, chunk: int = 65_536) -> SearchResult:
+    # worker i scans chunks i, i + workers, i + 2 * workers... so low nonces are tried first, and ranges never overlap
+    workers = workers or os.cpu_count() or 1
+    target = target_for_zeros() if target is None else target
+    prefix = block.header_prefix()
+    ctx = multiprocessing.get_context()
+    cancel = ctx.Event()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=(cancel,)) as pool:
+        pending = {pool.submit(_scan, prefix, target, i * chunk, workers * chunk, stop, chunk) for i in range(workers)}
+        nonce = None
+        hashes = 0
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, scanned = future.result()
+                hashes += scanned
+                if found is not None and nonce is None:
+                    nonce = found
+    result = SearchResult(nonce, hashes, time.perf_counter() - start, workers)
+    if metrics.enabled:  # the workers' own metrics stay in their processes
+        record_search(result.hashes, result.elapsed)
+    return result
@@ -1,5 +1,6 @@
 from engine.exception import VerifyFailed
-from engine.structs import OpCode
+import functools
+from engine.structs import OpCode, OpPushBytes, OpX
 
 def __bool01(b: bool) -> int:
     if b:
@@ -38,48 +39,71 @@ def _boolor(a: int, b: int) -> int:
     return __bool01(a != 0 or b != 0)
 
 
-false = OpCode(0, 'OP_FALSE', lambda : 0)
-true = OpCode(81, 'OP_TRUE', lambda : 1)
-nop = OpCode(97, 'OP_NOP', lambda : None)
-
-ifdup = OpCode(115, 'OP_IFDUP', _ifdup)
-drop = OpCode(117, 'OP_DROP', lambda x : None)
-dup = OpCode(118, 'OP_DUP', lambda x : [x, x])
-nip = OpCode(119, 'OP_NIP', lambda x, y: y)
-over = OpCode(120, 'OP_OVER', lambda x, y: [x, y, x])
-rot = OpCode(123, 'OP_ROT', lambda x, y, z: [y, z, x])
-swap = OpCode(124, 'OP_SWAP', lambda x, y: [y, x])
-tuck = OpCode(125, 'OP_TUCK', lambda x, y: [y, x, y])
-
-drop2 = OpCode(109, 'OP_2DUP', lambda x, y: None)
-dup2 = OpCode(110, 'OP_2DUP', lambda x, y: [x, y, x, y])
-dup3 = OpCode(111, 'OP_3DUP', lambda x, y, z: [x, y, z, x, y, z])
-
-add1 = OpCode(139, 'OP_1ADD', lambda x: x + 1)
-sub1 = OpCode(140, 'OP_1SUB', lambda x: x - 1)
-negate = OpCode(143, 'OP_NEGATE', lambda x: -x)
-abs_ = OpCode(144, 'OP_ABS', lambda x: abs(x))
-not_ = OpCode(145, 'OP_NOT', _not)
-add = OpCode(147, 'OP_ADD', lambda x, y: x + y)
-sub = OpCode(148, 'OP_SUB', lambda x, y: x - y)
+false = OpCode(0, 'OP_FALSE', lambda : 0, argnum=0, pushes=1)
+true = OpCode(81, 'OP_TRUE', lambda : 1, argnum=0, pushes=1)
+nop = OpCode(97, 'OP_NOP', lambda : None, argnum=0, pushes=0)
+
+ifdup = OpCode(115, 'OP_IFDUP', _ifdup, argnum=1, pushes=2)
+drop = OpCode(117, 'OP_DROP', lambda x : None, argnum=1, pushes=0)
+dup = OpCode(118, 'OP_DUP', lambda x : [x, x], argnum=1, pushes=2)
+nip = OpCode(119, 'OP_NIP', lambda x, y: y, argnum=2, pushes=1)
+over = OpCode(120, 'OP_OVER', lambda x, y: [x, y, x], argnum=2, pushes=3)
+rot = OpCode(123, 'OP_ROT', lambda x, y, z: [y, z, x], argnum=3, pushes=3)
+swap = OpCode(124, 'OP_SWAP', lambda x, y: [y, x], argnum=2, pushes=2)
+tuck = OpCode(125, 'OP_TUCK', lambda x, y: [y, x, y], argnum=2, pushes=3)
+
+drop2 = OpCode(109, 'OP_2DROP', lambda x, y: None, argnum=2, pushes=0)
+dup2 = OpCode(110, 'OP_2DUP', lambda x, y: [x, y, x, y], argnum=2, pushes=4)
+dup3 = OpCode(111, 'OP_3DUP', lambda x, y, z: [x, y, z, x, y, z], argnum=3, pushes=6)
+
+add1 = OpCode(139, 'OP_1ADD', lambda x: x + 1, argnum=1, pushes=1)
+sub1 = OpCode(140, 'OP_1SUB', lambda x: x - 1, argnum=1, pushes=1)
+negate = OpCode(143, 'OP_NEGATE', lambda x: -x, argnum=1, pushes=1)
+abs_ = OpCode(144, 'OP_ABS', lambda x: abs(x), argnum=1, pushes=1)
+not_ = OpCode(145, 'OP_NOT', _not, argnum=1, pushes=1)
+add = OpCode(147, 'OP_ADD', lambda x, y: x + y, argnum=2, pushes=1)
+sub = OpCode(148, 'OP_SUB', lambda x, y: x - y, argnum=2, pushes=1)
 # mul = OpCode(149, 'OP_MUL', lambda x, y: x * y)  # DISABLED in bitcoin
 # div = OpCode(150, 'OP_DIV', lambda x, y: x // y)  # DISABLED in bitcoin
 # mod = OpCode(151, 'OP_MOD', lambda x, y: x % y)  # DISABLED in bitcoin
-booland = OpCode(154, 'OP_BOOLAND', _booland)
-boolor = OpCode(155, 'OP_BOOLOR', _boolor)
-min_ = OpCode(163, 'OP_MIN', min)
-max_ = OpCode(164, 'OP_MAX', max)
-
-equal = OpCode(135, 'OP_EQUAL', _equal)
-notequal0 = OpCode(146, 'OP_0NOTEQUAL', lambda x : _notequal(x, 0))
-numequal = OpCode(156, 'OP_NUMEQUAL', _equal)
-numnotequal = OpCode(158, 'OP_NUMNOTEQUAL', _equal)
-lessthan = OpCode(159, 'OP_LESSTHAN', lambda x, y: __bool01(x < y))
-greaterthan = OpCode(160, 'OP_GREATERTHAN', lambda x, y: __bool01(x > y))
-lessthanorequal = OpCode(161, 'OP_LESSTHANOREQUAL', lambda x, y: __bool01(x <= y))
-greaterthanorequal = OpCode(162, 'OP_GREATERTHANOREQUAL', lambda x, y: __bool01(x >= y))
-within = OpCode(165, 'OP_WITHIN', lambda x, y, z: __bool01(y <= x <= z))
-
-verify = OpCode(105, 'OP_VERIFY', _verify)
-equalverify = OpCode(136, 'OP_EQUALVERIFY', _equalverify)
-numequalverify = OpCode(157, 'OP_NUMEQUALVERIFY', _equalverify)
+booland = OpCode(154, 'OP_BOOLAND', _booland, argnum=2, pushes=1)
+boolor = OpCode(155, 'OP_BOOLOR', _boolor, argnum=2, pushes=1)
+min_ = OpCode(163, 'OP_MIN', min, argnum=2, pushes=1)
+max_ = OpCode(164, 'OP_MAX', max, argnum=2, pushes=1)
+
+equal = OpCode(135, 'OP_EQUAL', _equal, argnum=2, pushes=1)
+notequal0 = OpCode(146, 'OP_0NOTEQUAL', lambda x : _notequal(x, 0), argnum=1, pushes=1)
+numequal = OpCode(156, 'OP_NUMEQUAL', _equal, argnum=2, pushes=1)
+numnotequal = OpCode(158, 'OP_NUMNOTEQUAL', _notequal, argnum=2, pushes=1)
+lessthan = OpCode(159, 'OP_LESSTHAN', lambda x, y: __bool01(x < y), argnum=2, pushes=1)
+greaterthan = OpCode(160, 'OP_GREATERTHAN', lambda x, y: __bool01(x > y), argnum=2, pushes=1)
+lessthanorequal = OpCode(161, 'OP_LESSTHANOREQUAL', lambda x, y: __bool01(x <= y), argnum=2, pushes=1)
+greaterthanorequal = OpCode(162, 'OP_GREATERTHANOREQUAL', lambda x, y: __bool01(x >= y), argnum=2, pushes=1)
+within = OpCode(165, 'OP_WITHIN', lambda x, y, z: __bool01(y <= x <= z), argnum=3, pushes=1)
+
+verify = OpCode(105, 'OP_VERIFY', _verify, argnum=1, pushes=0)
+equalverify = OpCode(136, 'OP_EQUALVERIFY', _equalverify, argnum=2, pushes=1)
+numequalverify = OpCode(157, 'OP_NUMEQUALVERIFY', _equalverify, argnum=2, pushes=1)
+
+
+numbers = {n: OpX(n) for n in range(-1, 17)}  # interned, pushing a small number never creates a new OpX
+
+def push_number(n: int) -> OpX:
+    if n in numbers:
+        return numbers[n]
+    return OpX(n)  # raises the right ValueError
+
+@functools.lru_cache(maxsize=4096)
+def push_bytes(hex_bytes: str) -> OpPushBytes:  # interned as well, scripts only differ in a few pushed values
+    return OpPushBytes(hex_bytes)
+
+def _opcode_table() -> list[OpCode | None]:  # indexed by opcode number, OP_PUSHBYTES (1-75) are not in there
+    table = [None] * 256
+    for opc in list(globals().values()):
+        if isinstance(opc, OpCode):
+            table[opc.number] = opc
+    for opc in numbers.values():  # OP_0 and OP_1 rather than OP_FALSE and OP_TRUE
+        table[opc.number] = opc
+    return table
+
+OPCODES = _opcode_table()
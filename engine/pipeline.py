@@ -0,0 +1,252 @@
+# Streaming ingest -> validate -> mempool -> assemble, with bounded queues between the stages
+#   python -m engine.pipeline --count 100000 --workers 2 --chain chain.log
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from engine import wire
+from engine.chain import Chain
+from engine.corpus import encoded_chunk
+from engine.game import Game
+from engine.mempool import Mempool
+from engine.nonce import search_prefix
+from engine.structs import Block, Transaction, TxOutput
+from engine.settings import CHAIN_PATH
+
+_DONE = None  # passed down the queues once a stage has nothing more to send
+
+
+class StageStats:
+    __slots__ = ('name', 'items', 'batches', 'busy', 'max_depth', '_depth_sum')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0  # transactions handled
+        self.batches = 0
+        self.busy = 0.0  # seconds spent working, not waiting for the previous stage
+        self.max_depth = 0  # of the queue this stage reads from, sampled whenever it takes a batch
+        self._depth_sum = 0
+
+    def waited(self, depth: int):
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_sum += depth
+
+    def done(self, items: int, busy: float):
+        self.items += items
+        self.batches += 1
+        self.busy += busy
+
+    def as_dict(self) -> dict:
+        return {
+            'items': self.items,
+            'batches': self.batches,
+            'busy_seconds': self.busy,
+            'items_per_sec': self.items / self.busy if self.busy > 0 else None,
+            'avg_queue_depth': self._depth_sum / self.batches if self.batches > 0 else 0.0,
+            'max_queue_depth': self.max_depth,
+        }
+
+
+def _decode(raw: bytes) -> tuple[list[Transaction], list[TxOutput]]:
+    txs, sources = [], []
+    for item in wire.iter_records(raw):
+        (txs if isinstance(item, Transaction) else sources).append(item)
+    return txs, sources
+
+
+class Pipeline:
+    def __init__(self, game: Game | None = None, chain: Chain | None = None, block_size: int = 3_500,
+                 batch_size: int = 1_000, queue_size: int = 4, workers: int | None = None,
+                 cpu_pool: ProcessPoolExecutor | None = None, mine: bool = False):
+        if cpu_pool is not None and not isinstance(cpu_pool, ProcessPoolExecutor):
+            # generate_chunk reseeds the generator's module-level RNG, threads would share and clobber it
+            raise ValueError(f'cpu_pool has to be a ProcessPoolExecutor, not {type(cpu_pool).__name__}')
+        self.game = Game() if game is None else game
+        self.chain = chain  # closed blocks are appended here, it has to be built on game.sources
+        if chain is not None:
+            self.game.block.prev_hash = chain.tip_hash
+        self.mempool = Mempool()
+        self.block_size = block_size
+        self.batch_size = batch_size
+        self.queue_size = queue_size  # batches waiting between two stages, a full queue pauses the stage before it
+        self.workers = workers or os.cpu_count() or 1
+        self.cpu_pool = ProcessPoolExecutor(self.workers) if cpu_pool is None else cpu_pool  # generation, nonce search
+        self.state_pool = ThreadPoolExecutor(1)  # the only thread that touches game state while the pipeline runs
+        self.mine = mine  # search for a nonce for every block, otherwise blocks are closed with nonce 0
+        self.stages = {name: StageStats(name) for name in ('ingest', 'validate', 'mempool', 'assemble')}
+        self.rejected: dict[str, int] = {}
+        self.blocks: list[str] = []  # hashes of the assembled blocks
+        self.elapsed = 0.0
+
+    async def run(self, count: int, seed: int | None = None, errors: dict[str, int] | None = None) -> dict:
+        seed = random.getrandbits(64) if seed is None else seed
+        validate_queue = asyncio.Queue(self.queue_size)
+        mempool_queue = asyncio.Queue(self.queue_size)
+        assemble_queue = asyncio.Queue(self.queue_size)
+        start = time.perf_counter()
+        await asyncio.gather(
+            self._ingest(count, seed, errors, validate_queue),
+            self._validate(validate_queue, mempool_queue),
+            self._fill_mempool(mempool_queue, assemble_queue),
+            self._assemble(assemble_queue),
+        )
+        self.elapsed = time.perf_counter() - start
+        return self.stats()
+
+    async def _ingest(self, count: int, seed: int, errors: dict[str, int] | None, out: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stats = self.stages['ingest']
+        sizes = [min(self.batch_size, count - start) for start in range(0, count, self.batch_size)]
+        pending = collections.deque()  # one chunk in flight per worker, taken in order like in corpus.write_corpus
+        submitted = 0
+        while submitted < len(sizes) or len(pending) > 0:
+            while submitted < len(sizes) and len(pending) < self.workers:
+                pending.append(loop.run_in_executor(self.cpu_pool, encoded_chunk, seed, submitted, sizes[submitted], errors))
+                submitted += 1
+            begin = time.perf_counter()
+            raw = await pending.popleft()
+            txs, sources = await loop.run_in_executor(None, _decode, raw)  # OpCodes can't be pickled, bytes can
+            stats.done(len(txs), time.perf_counter() - begin)
+            await out.put((txs, sources))
+        await out.put(_DONE)
+
+    def _validate_batch(self, txs: list[Transaction], sources: list[TxOutput]) -> list[Transaction]:
+        game = self.game
+        game.sources.extend(sources)
+        valid = []
+        for tx, error in zip(txs, game.validator.validate_batch(txs).errors):  # fetches all inputs at once
+            if error == 'none':
+                valid.append(tx)
+            else:
+                self.rejected[error] = self.rejected.get(error, 0) + 1
+        return valid
+
+    async def _validate(self, inp: asyncio.Queue, out: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stats = self.stages['validate']
+        while True:
+            stats.waited(inp.qsize())
+            batch = await inp.get()
+            if batch is _DONE:
+                break
+            begin = time.perf_counter()
+            valid = await loop.run_in_executor(self.state_pool, self._validate_batch, *batch)
+            stats.done(len(batch[0]), time.perf_counter() - begin)
+            await out.put(valid)
+        await out.put(_DONE)
+
+    def _template(self) -> Block:
+        block = self.mempool.build_template(self.block_size)
+        self.mempool.remove_block(block)
+        return block
+
+    async def _fill_mempool(self, inp: asyncio.Queue, out: asyncio.Queue):  # in the event loop, every call is short
+        stats = self.stages['mempool']
+        while True:
+            stats.waited(inp.qsize())
+            txs = await inp.get()
+            if txs is _DONE:
+                break
+            begin = time.perf_counter()
+            for tx in txs:
+                self.mempool.add(tx)
+            templates = []
+            while len(self.mempool) >= self.block_size:
+                templates.append(self._template())
+            stats.done(len(txs), time.perf_counter() - begin)
+            for block in templates:
+                await out.put(block)
+        if len(self.mempool) > 0:
+            await out.put(self._template())
+        await out.put(_DONE)
+
+    def _close_block(self, block: Block, nonce: int) -> str:
+        game = self.game
+        for tx in block.transactions:
+            game.accept(tx)
+        if self.chain is not None:
+            return game.close_block(self.chain, nonce)
+        block_hash = game.block.hash(nonce)
+        game.next_block(block_hash)
+        return block_hash
+
+    async def _assemble(self, inp: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        stats = self.stages['assemble']
+        while True:
+            stats.waited(inp.qsize())
+            block = await inp.get()
+            if block is _DONE:
+                break
+            begin = time.perf_counter()
+            block.prev_hash = self.game.block.prev_hash  # the previous block is closed by now
+            nonce = 0
+            if self.mine:
+                result = await loop.run_in_executor(self.cpu_pool, search_prefix, block.header_prefix())
+                nonce = 0 if result.nonce is None else result.nonce
+            self.blocks.append(await loop.run_in_executor(self.state_pool, self._close_block, block, nonce))
+            stats.done(len(block.transactions), time.perf_counter() - begin)
+
+    def bottleneck(self) -> str:  # the stage that was busy the longest limits the sustained rate
+        return max(self.stages.values(), key=lambda s: s.busy).name
+
+    def stats(self) -> dict:
+        ingested = self.stages['ingest'].items
+        return {
+            'transactions': ingested,
+            'blocks': len(self.blocks),
+            'rejected': dict(self.rejected),
+            'seconds': self.elapsed,
+            'tx_per_sec': ingested / self.elapsed if self.elapsed > 0 else None,
+            'bottleneck': self.bottleneck(),
+            'stages': {name: s.as_dict() for name, s in self.stages.items()},
+        }
+
+    def shutdown(self):
+        self.cpu_pool.shutdown(cancel_futures=True)
+        self.state_pool.shutdown()
+
+
+def printable(stats: dict) -> str:
+    lines = [f'{stats["transactions"]:,} transactions in {stats["seconds"]:.2f}s ({stats["tx_per_sec"]:,.0f} tx/sec), '
+             f'{stats["blocks"]} blocks, rejected: {stats["rejected"]}']
+    for name, s in stats['stages'].items():
+        rate = f'{s["items_per_sec"]:>12,.0f} tx/sec' if s['items_per_sec'] is not None else ' ' * 19
+        lines.append(f'{name:<9} {rate}  busy {s["busy_seconds"]:6.2f}s  '
+                     f'queue avg {s["avg_queue_depth"]:.1f} max {s["max_queue_depth"]}')
+    lines.append(f'Bottleneck: {stats["bottleneck"]}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate, validate and assemble transactions into blocks')
+    parser.add_argument('--count', type=int, default=100_000, help='transactions to generate')
+    parser.add_argument('--seed', type=int, help='same seed, same transactions')
+    parser.add_argument('--workers', type=int, help='processes for generation and nonce search')
+    parser.add_argument('--block-size', type=int, default=3_500)
+    parser.add_argument('--batch-size', type=int, default=1_000)
+    parser.add_argument('--mine', action='store_true', help='search for a nonce for every block')
+    parser.add_argument('--chain', help=f'append the blocks to this chain log (like {CHAIN_PATH}), '
+                                        'a sqlite UTXO_STORE carries the outputs over to the next run')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    game = Game()
+    chain = None if args.chain is None else Chain(args.chain, game.sources)
+    pipeline = Pipeline(game, chain, block_size=args.block_size, batch_size=args.batch_size, workers=args.workers,
+                        mine=args.mine)
+    try:
+        stats = asyncio.run(pipeline.run(args.count, args.seed))
+    finally:
+        pipeline.shutdown()
+        if chain is not None:
+            chain.close()
+    print(json.dumps(stats) if args.json else printable(stats))
+
+
+if __name__ == '__main__':
+    main()
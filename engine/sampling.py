@@ -0,0 +1,53 @@
+import bisect
+import itertools
+import random
+
+
+class Sampler:  # for weights that never change, built once, then every draw is a single bisect
+    def __init__(self, options: dict, rng: random.Random):
+        self.options = list(options)
+        self.cum_weights = list(itertools.accumulate(options.values()))
+        self.total = self.cum_weights[-1]
+        self.rng = rng
+        self._hi = len(self.options) - 1
+
+    def draw(self):
+        return self.options[bisect.bisect_right(self.cum_weights, self.rng.random() * self.total, 0, self._hi)]
+
+    def sample(self, n: int) -> list:
+        return self.rng.choices(self.options, cum_weights=self.cum_weights, k=n)
+
+
+class UpdatableSampler:  # for a handful of weights that change between draws, the total is kept up to date
+    def __init__(self, options: dict, rng: random.Random):
+        self.weights = dict(options)
+        self.total = sum(self.weights.values())
+        self.rng = rng
+
+    def update(self, option, delta: int):
+        self.weights[option] += delta
+        self.total += delta
+
+    def draw(self):
+        r = self.rng.random() * self.total
+        upto = 0
+        for o, w in self.weights.items():
+            upto += w
+            if upto > r:
+                return o
+        return o  # float rounding at the very end of the range
+
+    def draw_scaled(self, factors: dict):  # as if every weight was multiplied by its factor first
+        total = 0
+        for o, w in self.weights.items():
+            total += w * factors[o]
+        r = self.rng.random() * total
+        upto = 0
+        for o, w in self.weights.items():
+            upto += w * factors[o]
+            if upto > r:
+                return o
+        return o
+
+    def sample(self, n: int) -> list:
+        return self.rng.choices(list(self.weights), weights=list(self.weights.values()), k=n)
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from engine import op
+from engine.exception import VerifyFailed
+from engine.structs import OpCode
+from engine.settings import SCRIPT_CACHE_SIZE
+
+
+class CompiledScript:
+    def __init__(self, script: list[OpCode]):
+        # (argnum, body, constant) per opcode - pushes with no arguments are evaluated once, here
+        program = []
+        for opc in script:
+            if opc.argnum == 0:
+                program.append((0, None, opc.body()))
+            else:
+                program.append((opc.argnum, opc.body, None))
+        self.program = tuple(program)
+        self.names = tuple(opc.name for opc in script)
+
+    def evaluate(self) -> VerifyFailed | None:  # None means the script passed
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        for i, (argnum, body, constant) in enumerate(self.program):
+            if argnum == 0:
+                if constant is not None:
+                    push(constant)
+                continue
+            if len(stack) < argnum:
+                return VerifyFailed(f'{self.names[i]}: not enough elements on the stack')
+            try:
+                if argnum == 1:
+                    ret = body(pop())
+                elif argnum == 2:
+                    b = pop()
+                    ret = body(pop(), b)
+                else:
+                    args = stack[-argnum:]
+                    del stack[-argnum:]
+                    ret = body(*args)
+            except VerifyFailed:
+                return VerifyFailed(f'{self.names[i]} failed')
+            if ret is not None:
+                if type(ret) is list or type(ret) is tuple:
+                    stack.extend(ret)
+                else:
+                    push(ret)
+        if len(stack) > 0 and stack[-1] == 0:
+            return VerifyFailed('Script finished with false on top of the stack')
+        return None
+
+    def passes(self) -> bool:
+        return self.evaluate() is None
+
+    def __len__(self) -> int:
+        return len(self.program)
+
+
+def compile_script(script_sig: list[OpCode], script_pub_key: list[OpCode] = ()) -> CompiledScript:
+    return CompiledScript(list(script_sig) + list(script_pub_key))
+
+
+def script_key(script_sig: list[OpCode], script_pub_key: list[OpCode]) -> str:
+    return ''.join(opc.to_hex() for opc in script_sig) + ''.join(opc.to_hex() for opc in script_pub_key)
+
+
+class ScriptCache:  # bounded LRU of verification results, keyed by the scripts' hex
+    def __init__(self, max_size: int = SCRIPT_CACHE_SIZE):
+        self.max_size = max_size
+        self._results: OrderedDict[str, VerifyFailed | None] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def verify(self, script_sig: list[OpCode], script_pub_key: list[OpCode]) -> VerifyFailed | None:
+        key = script_key(script_sig, script_pub_key)
+        results = self._results
+        if key in results:
+            self.hits += 1
+            results.move_to_end(key)
+            return results[key]
+        self.misses += 1
+        result = compile_script(script_sig, script_pub_key).evaluate()
+        results[key] = result
+        if len(results) > self.max_size:
+            results.popitem(last=False)
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+verification_cache = ScriptCache()  # one per process, shared by every Game and Validator
+
+
+def verify(script_sig: list[OpCode], script_pub_key: list[OpCode]) -> VerifyFailed | None:  # None means it passed
+    return verification_cache.verify(script_sig, script_pub_key)
+
+
+def apply_script(script: list[OpCode]) -> VerifyFailed | None:  # reference path, one OpCode.apply per operation
+    stack = []
+    try:
+        for opc in script:
+            opc.apply(stack)
+    except IndexError as e:
+        return VerifyFailed(str(e))
+    except VerifyFailed as e:
+        return e
+    if len(stack) > 0 and stack[-1] == 0:
+        return VerifyFailed('Script finished with false on top of the stack')
+    return None
+
+
+def decode_script(data: bytes | memoryview | str) -> list[OpCode]:  # reverses to_hex, hex strings are accepted too
+    if isinstance(data, str):
+        data = bytes.fromhex(data)
+    table = op.OPCODES  # every opcode object is shared, decoding never creates new ones (except for new pushes)
+    push_bytes = op.push_bytes
+    script = []
+    append = script.append
+    pos = 0
+    end = len(data)
+    while pos < end:
+        number = data[pos]
+        pos += 1
+        opc = table[number]
+        if opc is not None:
+            append(opc)
+        elif 1 <= number <= 75:  # OP_PUSHBYTES, followed by the pushed bytes
+            append(push_bytes(data[pos:pos + number].hex()))
+            pos += number
+        else:
+            raise ValueError(f'Unknown opcode {number:02x}')
+    return script
+
+
+def encode_script(script: list[OpCode]) -> bytes:
+    return bytes.fromhex(''.join(opc.to_hex() for opc in script))
@@ -0,0 +1,135 @@
+# Line protocol game server: every connection gets its own Session, every command line gets one JSON line back
+import argparse
+import asyncio
+import json
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable
+from engine.game import Game
+from engine.nonce import SearchResult, search_prefix
+from engine.session import Session
+from engine.structs import Block
+from engine.utxo import UtxoSet, SqliteUtxoStore
+
+HEAVY_COMMANDS = ('nonce',)  # run in a thread, so the event loop keeps serving other sessions
+
+
+class GameServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8333, cpu_pool: Executor | None = None,
+                 new_store: Callable[[], UtxoSet | SqliteUtxoStore] = UtxoSet):
+        self.host = host
+        self.port = port
+        self.new_store = new_store  # called once per session, players must not share outputs (not UTXO_STORE's file)
+        self.cpu_pool = ProcessPoolExecutor() if cpu_pool is None else cpu_pool  # nonce search
+        self.sessions = 0
+        self._clients: dict[asyncio.Task, asyncio.StreamWriter] = {}  # open connections, closed by stop
+        self._server: asyncio.AbstractServer | None = None
+
+    def _search(self, block: Block) -> SearchResult:  # called from a worker thread, waits for a worker process
+        return self.cpu_pool.submit(search_prefix, block.header_prefix()).result()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session(Game(sources=self.new_store()), search=self._search)
+        self.sessions += 1
+        self._clients[asyncio.current_task()] = writer
+        loop = asyncio.get_running_loop()
+        try:
+            while not session.finished:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', errors='replace')
+                words = line.split()
+                if len(words) > 0 and words[0].lower() in HEAVY_COMMANDS:
+                    output = await loop.run_in_executor(None, session.handle, line)
+                else:
+                    output = session.handle(line)
+                response = {'output': output, 'finished': session.finished}
+                if session.finished:
+                    response['summary'] = session.summary()
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            self._clients.pop(asyncio.current_task(), None)
+            session.game.end()
+            if isinstance(session.game.sources, SqliteUtxoStore):
+                session.game.sources.close()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=2 ** 16)
+        self.port = self._server.sockets[0].getsockname()[1]  # when started with port 0
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for writer in self._clients.values():  # their readline returns, so every session ends on its own
+            writer.close()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+        self.cpu_pool.shutdown(cancel_futures=True)
+
+
+async def _client(host: str, port: int, commands: list[str], latencies: list[float]):
+    reader, writer = await asyncio.open_connection(host, port)
+    loop = asyncio.get_running_loop()
+    try:
+        for command in commands:
+            start = loop.time()
+            writer.write(command.encode('utf-8') + b'\n')
+            await writer.drain()
+            if not await reader.readline():
+                break
+            latencies.append(loop.time() - start)
+    finally:
+        writer.close()
+
+
+def _percentile(ordered: list[float], percent: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+async def load_test(host: str, port: int, sessions: int = 1000, rounds: int = 5) -> dict:
+    # every session handles a few transactions, then asks for its reward
+    commands = ['tx new', 'tx', 'tx count', 'accept'] * rounds + ['reward', 'nonce 1']
+    latencies: list[float] = []
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await asyncio.gather(*(_client(host, port, commands, latencies) for _ in range(sessions)))
+    elapsed = loop.time() - start
+    latencies.sort()
+    return {
+        'sessions': sessions,
+        'commands': len(latencies),
+        'commands_per_sec': len(latencies) / elapsed,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CryptoMiner game server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8333)
+    args = parser.parse_args()
+    server = GameServer(args.host, args.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import time
+from datetime import timedelta
+from engine.structs import Transaction
+from engine.game import Game
+from engine.nonce import MAX_NONCE, SearchResult, parallel_search
+from engine.settings import *
+
+
+class Session:  # one player's game, commands return the text that the CLI prints
+    def __init__(self, game: Game | None = None, search=parallel_search):
+        self.game = Game() if game is None else game
+        self.search = search  # Block -> SearchResult, used by "nonce auto"
+        self.current_tx: Transaction | None = None
+        self.reward_requested: int | None = None
+        self.found_nonce: int | None = None  # from the last "nonce auto"
+        self.finished = False
+        self.start_time = time.time()
+
+    def handle(self, line: str) -> str:
+        inp = line.strip().strip('/').split()
+        if len(inp) == 0:
+            return ''
+        command, args = inp[0].lower(), inp[1:]
+        if command in ('transaction', 'tx'):
+            return self.transaction(args)
+        elif command in ('utxo', 'utxos', 'input'):
+            return self.utxo(args)
+        elif command == 'accept':
+            return self.accept()
+        elif command == 'reject':
+            return self.reject()
+        elif command in ('reward', 'prize', 'payout'):
+            return self.reward()
+        elif command == 'nonce':
+            return self.nonce(args)
+        elif command in ('close', 'end', 'sign'):
+            return self.close(args)
+        else:
+            return f'Unknown command "{command}"'
+
+    def transaction(self, args_: list[str]) -> str:
+        if len(args_) < 1:
+            if self.current_tx is None:
+                return 'No pending transaction. Get a new one with "transaction new"'
+            return self.current_tx.printable()
+        elif args_[0] in ('new', 'get'):
+            if self.current_tx is not None:
+                return f'Transaction {self.current_tx.tx_id} is still waiting for your decision'
+            self.current_tx = self.game.new_tx()
+            return f'New transaction obtained! View it with "transaction"'
+        elif args_[0] in ('count', 'stats'):
+            accepted_ = len(self.game.block.transactions)
+            rejected_ = len(self.game.rejected_tx)
+            message = f'You have processed {accepted_ + rejected_} transactions so far ({accepted_} accepted, {rejected_} rejected)'
+            if self.current_tx is not None:
+                message += f'. Also, one more is waiting for your decision'
+            return message
+        else:
+            return f'Unknown subcommand "{args_[0]}"'
+
+    def utxo(self, args_: list[str]) -> str:
+        if len(args_) < 1:
+            return 'You need to provide transaction ID'
+        tx_id = args_[0]
+        sources = self.game.source_lookup(tx_id)
+        if len(sources) == 0:
+            return f'Transaction {tx_id} not found'
+        return '\n'.join(src.printable() for src in sources)
+
+    def accept(self) -> str:
+        if self.current_tx is None:
+            return 'Nothing to accept. Get a new transaction with "transaction new"'
+        self.game.accept(self.current_tx)
+        message = f'Transaction {self.current_tx.tx_id} accepted'
+        self.current_tx = None
+        return message
+
+    def reject(self) -> str:
+        if self.current_tx is None:
+            return 'Nothing to reject. Get a new transaction with "transaction new"'
+        self.game.reject(self.current_tx)
+        message = f'Transaction {self.current_tx.tx_id} rejected'
+        self.current_tx = None
+        return message
+
+    def reward(self) -> str:
+        if self.current_tx is not None:
+            return f'Transaction {self.current_tx.tx_id} is still waiting for your decision'
+        elif len(self.game.block.transactions) < REQUIRED_TX:
+            return f'You have only {len(self.game.block.transactions)} out of {REQUIRED_TX} required accepted transactions.'
+        self.reward_requested = self.game.block.reward(include_wrong=True)
+        _btc = self.reward_requested / 100_000_000
+        return f'You have requested a reward of {_btc} BTC (3.125 for mining + sum of transaction fees)'
+
+    def nonce(self, args_: list[str]) -> str:  # "nonce <number>" tests one value, "nonce auto" searches
+        if self.reward_requested is None:
+            return f'You have not requested a reward yet. Do it with "reward"'
+        elif len(args_) < 1:
+            return f'Test a value with "nonce <number>" or search automatically with "nonce auto"'
+        elif args_[0] in ('auto', 'search'):
+            result: SearchResult = self.search(self.game.block)
+            self.found_nonce = result.nonce
+            message = result.printable()
+            if result.nonce is not None:
+                message += f'\nBlock hash for nonce={result.nonce}: {self.game.block.hash(result.nonce)}'
+            return message
+        try:
+            nonce = int(args_[0])
+        except ValueError:
+            return 'Nonce has to be a number'
+        return f'Block hash for nonce={nonce}: {self.game.block.hash(nonce)}'
+
+    def close(self, args_: list[str]) -> str:
+        if self.reward_requested is None:
+            return f'You have not requested a reward yet. Do it with "reward"'
+        elif len(args_) < 1:
+            return f'You need to provide the nonce value, such that this block\'s hash starts with {ZEROS_REQUIRED} zeros'
+        try:
+            nonce = int(args_[0])
+        except ValueError:
+            return 'Nonce has to be a number'
+        if nonce >= MAX_NONCE:
+            return 'Nonce needs to take up at most 4 bytes'
+        block_hash = self.game.block.hash(nonce)
+        if not block_hash.startswith('0' * ZEROS_REQUIRED):
+            return f'With that nonce, the block hash is {block_hash}, so does not start with {ZEROS_REQUIRED} zeros'
+        self.finished = True
+        return f'Success! Your own block {block_hash} is ready to go!'
+
+    def stats(self) -> dict:  # machine-readable version of summary()
+        elapsed = time.time() - self.start_time
+        tx_num = len(self.game.block.transactions) + len(self.game.rejected_tx)
+        summary = self.game.result_summary()
+        return {
+            'transactions': tx_num,
+            'accepted': len(self.game.block.transactions),
+            'rejected': len(self.game.rejected_tx),
+            'correct': summary[True],
+            'incorrect': summary[False],
+            'seconds': elapsed,
+            'seconds_per_tx': elapsed / tx_num if tx_num > 0 else None,
+            'reward': self.game.block.reward(include_wrong=False),
+            'reward_requested': self.reward_requested,
+        }
+
+    def summary(self) -> str:
+        game = self.game
+        elapsed = time.time() - self.start_time
+        elapsed_delta = timedelta(seconds=elapsed)
+        tx_num = len(game.block.transactions) + len(game.rejected_tx)
+        summary = game.result_summary()
+        real_reward = game.block.reward(include_wrong=False)
+        reward_diff = self.reward_requested - real_reward
+        btc = real_reward / 100_000_000
+        btc_diff = reward_diff / 100_000_000
+
+        lines = ['Congratulations! You have published your block! Time for some results:', '---']
+        lines.append(f'You processed {tx_num} transactions in {elapsed_delta}')
+        lines.append(f'\t...that is {elapsed / tx_num:.2f} seconds per transaction!')
+        lines.append('---')
+        lines.append(f'Transaction decisions - {summary[True]} correct and {summary[False]} incorrect:')
+        for r in game.results:
+            lines.append('...' + r.printable())
+        lines.append('---')
+        lines.append(f'You got a reward of {btc} BTC (3.125 for mining + sum of transaction fees)')
+        if btc_diff > 0:
+            lines.append(f'\t...although you requested {btc_diff} BTC more (a bit greedy, aren\'t we?)')
+        elif btc_diff < 0:
+            lines.append(f'\t...although you requested {abs(btc_diff)} BTC less (don\'t be so modest)')
+        else:
+            lines.append('\t...and this is exactly how much you requested. Perfect!')
+        return '\n'.join(lines)
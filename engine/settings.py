@@ -8,4 +8,9 @@ MESSAGES = {
 }
 PROMPT = '~ CryptoMiner ~'
 ZEROS_REQUIRED = 2
-SCRIPT_LENGTH = 3  # Relative script length. 2 will be extremely short, 10 will be extremely long.
\ No newline at end of file
+SCRIPT_LENGTH = 3  # Relative script length. 2 will be extremely short, 10 will be extremely long.
+UTXO_STORE = 'memory'  # 'memory' keeps outputs in RAM only, 'sqlite' keeps them in UTXO_DB_PATH between runs
+UTXO_DB_PATH = 'utxo.sqlite3'
+UTXO_CACHE_SIZE = 100_000  # decoded outputs kept in memory by the 'sqlite' store
+CHAIN_PATH = 'chain.log'  # closed blocks, the height/hash index is kept next to it in CHAIN_PATH + '.idx'
+SCRIPT_CACHE_SIZE = 100_000  # verification results remembered by script.verify, shared by all games
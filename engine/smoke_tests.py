@@ -1,5 +1,33 @@
+import asyncio
+import os
+import random
+from engine import base58, generator, op, wire
+from engine.chain import Chain
+from engine.corpus import generate_batches, generate_chunk
+from engine.exception import VerifyFailed
+from engine.game import Game
 from engine.generator import generate_arithmetic_script, generate_tx, weighed_choice
-from engine import base58
+from engine.mempool import Mempool
+from engine.merkle import verify_proof
+from engine.nonce import NonceSearch
+from engine.pipeline import Pipeline
+from engine.sampling import Sampler, UpdatableSampler
+from engine.script import CompiledScript, ScriptCache, apply_script
+from engine.session import Session
+from engine.snapshot import restore, restore_session, snapshot
+from engine.structs import GENESIS_HASH, Block, Transaction
+from engine.utxo import SqliteUtxoStore, UtxoSet
+from engine.validator import Validator
+
+def _state(utxos) -> set:  # everything about the outputs, to compare two stores
+    return {(src.tx_id, src.index, src.amount, src.spent, tuple(opc.to_hex() for opc in src.script)) for src in utxos}
+
+def _expected_labels(count: int, seed: int, batch_size: int) -> dict[str, int]:  # what the pipeline should decide
+    expected = {}
+    for txs, _ in generate_batches(count, seed=seed, batch_size=batch_size):
+        for tx in txs:
+            expected[tx.error] = expected.get(tx.error, 0) + 1
+    return expected
 
 def test_script_generation():
     correct = generate_arithmetic_script(correct=True)
@@ -36,8 +64,356 @@ def test_weighed_choice():
         occurs[choice] += 1
     print(occurs)
 
+def test_compiled_script():
+    mismatches = {True: 0, False: 0}
+    for i in range(2000):
+        correct = i % 2 == 0
+        script = generate_arithmetic_script(correct)
+        compiled = CompiledScript(script).passes()
+        if compiled != correct or compiled != (apply_script(script) is None):
+            mismatches[correct] += 1
+    print(f'Compiled script mismatches (should be zeros): {mismatches}')
+
+def test_stack_effects():  # every opcode changes the stack by exactly what it declares
+    wrong = []
+    for opc in op.OPCODES:
+        if opc is None:
+            continue
+        consumed, produced = opc.stack_effect
+        stack = [7, 5, 3, 2, 1][:max(consumed, 1)]
+        before = len(stack)
+        try:
+            opc.apply(stack)
+        except VerifyFailed:
+            continue
+        if len(stack) != before - consumed + produced:
+            wrong.append(opc.name)
+    print(f'Opcodes with a wrong stack effect (should be none): {wrong}')
+
+def test_validator():
+    sources = []
+    txs = [generate_tx(sources) for _ in range(2000)]
+    result = Validator(sources).validate_batch(txs)
+    wrong = sum(1 for tx, e in zip(txs, result.errors) if tx.error != e)
+    print(f'{result.printable()}, {wrong} wrong decisions (should be zero)')
+
+def test_script_cache():
+    scripts = [generate_arithmetic_script(correct=i % 2 == 0) for i in range(200)]
+    cache = ScriptCache(max_size=100)
+    mismatches = 0
+    for script in scripts + scripts[-50:]:  # the last 50 are still cached, the first ones were evicted
+        if (cache.verify(script, []) is None) != (apply_script(script) is None):
+            mismatches += 1
+    print(f'{len(cache)} cached results (should be 100), {cache.hits} hits (should be 50), '
+          f'{cache.hit_rate:.0%} hit rate, {mismatches} mismatches (should be zero)')
+
+def test_sqlite_utxo_store(path: str = 'smoke_utxo.sqlite3'):
+    store = SqliteUtxoStore(path, cache_size=100)
+    txs = [generate_tx(store) for _ in range(500)]
+    store.close()
+    store = SqliteUtxoStore(path, cache_size=100)  # reopened, so everything is read back from disk
+    result = Validator(store).validate_batch(txs)
+    wrong = sum(1 for tx, e in zip(txs, result.errors) if tx.error != e)
+    print(f'{len(store)} outputs on disk, {wrong} wrong decisions after reopening (should be zero)')
+    store.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def test_nonce_search():
+    block = Block()
+    sources = []
+    for _ in range(10):
+        block.add(generate_tx(sources))
+    nonce = NonceSearch(block).search()
+    print(f'Nonce {nonce} -> {block.hash(nonce)}')
+
+def test_merkle_proofs():
+    block = Block()
+    sources = []
+    failed = 0
+    for size in range(1, 40):
+        block.add(generate_tx(sources))
+        root = block.merkle_root()
+        failed += sum(1 for tx in block.transactions if not verify_proof(tx.tx_id, block.proof(tx.tx_id), root))
+    print(f'{failed} failed inclusion proofs (should be zero)')
+
+def test_reproducible_corpus():
+    first, _ = generate_chunk(seed=42, chunk_index=3, size=200)
+    second, _ = generate_chunk(seed=42, chunk_index=3, size=200)
+    same = all(a.tx_id == b.tx_id and a.fee == b.fee and a.error == b.error for a, b in zip(first, second))
+    print(f'Same seed gives the same transactions: {same}')
+    ids = []
+    for _ in range(2):  # a chunk in between must not disturb the caller's seed
+        generator.seed(5)
+        generate_chunk(seed=42, chunk_index=0, size=10)
+        ids.append(generate_tx([]).tx_id)
+    generator.seed(None)
+    print(f'Caller\'s seed survives a chunk: {ids[0] == ids[1]}')
+
+def test_samplers():
+    chances = {'a': 1, 'b': 7, 'c': 2, 'd': 0, 'e': 4}
+    expected = {o: 14000 * w // sum(chances.values()) for o, w in chances.items()}
+    rng = random.Random(1)
+    for sampler in (Sampler(chances, rng), UpdatableSampler(chances, rng)):
+        drawn = {o: 0 for o in chances}
+        for _ in range(14000):
+            drawn[sampler.draw()] += 1
+        bulk = {o: 0 for o in chances}
+        for o in sampler.sample(14000):
+            bulk[o] += 1
+        print(f'{type(sampler).__name__}: expected {expected}, drawn {drawn}, sampled {bulk}')
+
+def test_base58_round_trip():
+    rng = random.Random(58)
+    failed = 0
+    for _ in range(10000):
+        number = rng.getrandbits(rng.randint(0, 512))
+        data = bytes(rng.randint(0, 3)) + rng.randbytes(rng.randint(0, 40))
+        failed += base58.decode_int(base58.encode(number)) != number
+        failed += base58.decode_bytes(base58.encode_bytes(data)) != data
+    batch = [rng.randbytes(32) for _ in range(100)]
+    failed += base58.decode_many(base58.encode_many(batch)) != batch
+    address = base58.encode(bytes.fromhex('00010966776006953D5567439E5E39F86A0D273BEED61967F6'))
+    print(f'{failed} failed round trips (should be zero), {address} (should be 16UwLL9Risc3QfPqBUvKofHmBQ7wMtjvM)')
+
+def test_wire_round_trip():
+    sources = []
+    txs = [generate_tx(sources) for _ in range(500)]
+    data = wire.encode_records(sources + txs)
+    parsed = list(wire.iter_records(data))
+    same = wire.encode_records(parsed) == data
+    sizes = all(wire.transaction_size(tx) == len(wire.encode_records((tx,))) for tx in txs)
+    print(f'{len(parsed)} records in {len(data)} bytes, identical after re-encoding: {same}, sizes counted right: {sizes}')
+
+def test_mempool_template():
+    sources = []
+    txs = [generate_tx(sources) for _ in range(1000)]
+    mempool = Mempool()
+    for tx in txs:
+        mempool.add(tx)
+    block = mempool.build_template(100)
+    best_fees = sorted((tx.fee for tx in txs), reverse=True)[:100]
+    print(f'Template has the 100 highest fees: {block.fees == sum(best_fees)}, reward {block.reward(include_wrong=True)}')
+
+def test_double_spend():
+    game = Game()
+    txs = [game.new_tx() for _ in range(1000)]
+    valid = [tx for tx in txs if tx.error == 'none']
+    for tx in valid:
+        game.accept(tx)
+    twins = [Transaction(tx.tx_id + '2', tx.input, tx.outputs, tx.total, tx.fee, 'already_spent') for tx in valid]
+    found = sum(game.block.conflicts(t) for t in twins)
+    labels = sum(game.validate(t) == 'already_spent' for t in twins)
+    print(f'{found} of {len(twins)} double-spends conflict with the block, {labels} labelled already_spent')
+    game.reject(valid[0])
+    print(f'Taking one back unspends it: {not game.sources.is_spent(valid[0].input.tx_id, valid[0].input.index)}, '
+          f'{len(game.block.transactions)} left in the block, {sum(game.block.conflicts(t) for t in twins)} conflicts')
+    game.accept(twins[1])  # a double-spend of valid[1], which it replaces once valid[1] is taken back
+    game.reject(valid[1])
+    outpoint = (valid[1].input.tx_id, valid[1].input.index)
+    third = Transaction(valid[1].tx_id + '3', valid[1].input, valid[1].outputs, valid[1].total, valid[1].fee, 'already_spent')
+    print(f'The twin left in the block keeps the output spent: {game.sources.is_spent(*outpoint)}, '
+          f'marked for it: {game.marked.get(twins[1].tx_id) == outpoint}, '
+          f'a third spender is {game.validate(third)} and conflicts: {game.block.conflicts(third)}')
+    game.reset()
+    unspent = all(not game.sources.is_spent(tx.input.tx_id, tx.input.index) for tx in valid)
+    print(f'After reset: {len(game.block.transactions)} in the block, all outputs unspent again: {unspent}')
+
+def test_chain(path: str = 'smoke_chain.log'):
+    game = Game()
+    chain = Chain(path, game.sources)
+    txs = [game.new_tx() for _ in range(1000)]
+    before = _state(game.sources)
+    hashes = []
+    for nonce in range(5):
+        for tx in txs[nonce * 200:(nonce + 1) * 200]:
+            game.accept(tx)
+        hashes.append(game.close_block(chain, nonce))
+    tip = _state(game.sources)
+    chain.close()
+
+    os.remove(path + '.idx')  # rebuilt from the log
+    replayed = Chain(path, UtxoSet())  # a new store gets every block applied
+    found = all(replayed.block_by_hash(h).height == height for height, h in enumerate(hashes))
+    linked = [replayed.block_at(height).prev_hash for height in range(len(hashes))] == [GENESIS_HASH] + hashes[:-1]
+    print(f'Chain of {len(replayed)} blocks, found by hash: {found}, linked by previous hash: {linked}, '
+          f'replayed outputs match the tip: {_state(replayed.utxos) <= tip}')
+    replayed.close()
+
+    chain = Chain(path, game.sources)  # already at the tip, nothing is applied twice
+    try:
+        chain.append(Block(), 0)
+        stale = 'appended'
+    except ValueError:
+        stale = 'refused'
+    chain.rewind(-1)
+    print(f'A block on an old tip is {stale} (should be refused), after popping every block: {len(chain)} left, '
+          f'outputs as before: {_state(game.sources) == before}')
+    chain.close()
+    os.remove(path)
+    os.remove(path + '.idx')
+
+def test_chain_log_checks(path: str = 'smoke_chain.log'):
+    with open(path, 'w') as f:
+        f.write('not a chain log\n')
+    try:
+        Chain(path).close()
+        refused = False
+    except ValueError:
+        refused = True
+    with open(path) as f:
+        intact = f.read() == 'not a chain log\n'
+    print(f'Another file is refused: {refused}, left as it was: {intact}, no index made: {not os.path.exists(path + ".idx")}')
+    os.remove(path)
+
+    game = Game()
+    chain = Chain(path, game.sources)
+    for nonce in range(3):
+        for _ in range(50):
+            game.accept(game.new_tx())
+        game.close_block(chain, nonce)
+    chain.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'\x00\x00\x01\x00torn')  # a record cut short by a crash
+    os.remove(path + '.idx')
+    chain = Chain(path, UtxoSet())
+    print(f'Torn last record dropped: {os.path.getsize(path) == size}, {len(chain)} blocks kept (should be 3)')
+    chain.close()
+    with open(path, 'r+b') as f:  # a flipped byte in the first block, with checked blocks after it
+        f.seek(100)
+        byte = f.read(1)[0]
+        f.seek(100)
+        f.write(bytes([byte ^ 0xff]))
+    corrupt = []
+    for rebuild in (False, True):
+        if rebuild:
+            os.remove(path + '.idx')
+        try:
+            Chain(path, UtxoSet()).close()
+            corrupt.append('accepted')
+        except ValueError:
+            corrupt.append('refused')
+    print(f'Corrupt block with an index: {corrupt[0]}, without one: {corrupt[1]} (should be refused), '
+          f'log still {"intact" if os.path.getsize(path) == size else "truncated"}')
+    for file in (path, path + '.idx'):
+        if os.path.exists(file):
+            os.remove(file)
+
+def test_sqlite_chain(path: str = 'smoke_chain.log', db_path: str = 'smoke_chain.sqlite3'):
+    game = Game(sources=SqliteUtxoStore(db_path))
+    chain = Chain(path, game.sources)
+    for nonce in range(3):
+        for _ in range(100):
+            game.accept(game.new_tx())
+        game.close_block(chain, nonce)
+    txs = [game.new_tx() for _ in range(100)]  # a block that is never closed, wrong transactions included
+    tip = _state(game.sources)
+    for tx in txs:
+        game.accept(tx)
+    game.end()
+    chain.close()
+    game.sources.close()
+
+    store = SqliteUtxoStore(db_path)  # reopened, at the tip already - no block is applied again
+    chain = Chain(path, store)
+    print(f'Reopened sqlite store is at the tip: {store.tip == chain.tip_hash}, outputs unchanged: {_state(store) == tip} '
+          f'(nothing spent by the unclosed block)')
+    chain.close()
+    store.close()
+    for file in (path, path + '.idx', db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(file):
+            os.remove(file)
+
+def test_pipeline(count: int = 5_000):
+    expected = _expected_labels(count, seed=7, batch_size=500)
+    pipeline = Pipeline(block_size=1_000, batch_size=500, workers=1)
+    try:
+        stats = asyncio.run(pipeline.run(count, seed=7))
+    finally:
+        pipeline.shutdown()
+    rejected = {e: n for e, n in expected.items() if e != 'none'}
+    assembled = stats['stages']['assemble']['items']
+    print(f'Rejected as generated: {stats["rejected"] == rejected}, '
+          f'{assembled} of {expected["none"]} correct transactions in {stats["blocks"]} blocks')
+
+def test_sqlite_pipeline(count: int = 3_000, path: str = 'smoke_pipeline.sqlite3'):
+    expected = _expected_labels(count, seed=7, batch_size=500)
+    store = SqliteUtxoStore(path)  # opened here, used from the pipeline's state thread
+    pipeline = Pipeline(Game(sources=store), block_size=1_000, batch_size=500, workers=1)
+    try:
+        stats = asyncio.run(pipeline.run(count, seed=7))
+    finally:
+        pipeline.shutdown()
+    rejected = {e: n for e, n in expected.items() if e != 'none'}
+    print(f'With the sqlite store - rejected as generated: {stats["rejected"] == rejected}, '
+          f'{stats["stages"]["assemble"]["items"]} of {expected["none"]} correct transactions in {stats["blocks"]} blocks')
+    store.close()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def test_snapshot(path: str = 'smoke_game.snapshot'):
+    game = Game()
+    for i in range(500):
+        tx = game.new_tx()
+        game.accept(tx) if i % 3 else game.reject(tx)
+    snapshot(game, path)
+    restored = restore(path)
+    same = (_state(restored.sources) == _state(game.sources)
+            and restored.block.merkle_root() == game.block.merkle_root()
+            and [tx.tx_id for tx in restored.rejected_tx] == [tx.tx_id for tx in game.rejected_tx]
+            and restored.result_summary() == game.result_summary()
+            and restored.marked == game.marked)
+    print(f'Restored game is the same: {same}, {len(restored.sources)} outputs')
+    unknown = [restored.sources.get('0OIl', 0), restored.sources.get('z' * 60, 0),  # not base58, longer than 32 bytes
+               restored.sources.lookup('0OIl'), restored.sources.lookup('z' * 60)]
+    print(f'Ids that are not base58 or too long are unknown, not errors: {unknown == [None, None, [], []]}')
+    restored.reset()
+    game.reset()
+    same = _state(restored.sources) == _state(game.sources)
+    tx = restored.new_tx()
+    print(f'After reset, outputs are the same: {same}, new transaction validated as {restored.validate(tx)} '
+          f'(generated as {tx.error})')
+    restored.sources.close()
+
+    session = Session(game)
+    for _ in range(3):
+        session.handle('tx new')
+        session.handle('accept')
+    session.handle('reward')
+    session.found_nonce = 123
+    session.handle('tx new')  # still pending when the game is saved
+    snapshot(game, path, session)
+    resumed = restore_session(path)
+    same = (resumed.current_tx.tx_id == session.current_tx.tx_id
+            and resumed.reward_requested == session.reward_requested and resumed.found_nonce == 123)
+    print(f'Restored session has the pending transaction and the requested reward: {same}')
+    resumed.game.sources.close()
+    os.remove(path)
+
 
 # test_script_generation()
 # test_base58()
 # test_transaction_generation()
 # test_weighed_choice()
+# test_compiled_script()
+# test_validator()
+# test_sqlite_utxo_store()
+# test_nonce_search()
+# test_merkle_proofs()
+# test_reproducible_corpus()
+# test_samplers()
+# test_base58_round_trip()
+# test_wire_round_trip()
+# test_mempool_template()
+# test_script_cache()
+# test_stack_effects()
+# test_double_spend()
+# test_chain()
+# test_chain_log_checks()
+# test_sqlite_chain()
+# test_pipeline()
+# test_sqlite_pipeline()
+# test_snapshot()
@@ -0,0 +1,257 @@
+# Game state in one versioned binary file, restored without reading the outputs
+#   header:   magic | version | (offset, size) of every section
+#   sections: output index (sorted fixed-size entries) | outputs (wire records) | block | rejected | results | session
+#   block:    previous hash (20) | tip of the outputs (20) | transactions
+#   session:  pending transaction (count 0 or 1, then the transaction) | reward requested + 1 | found nonce + 1
+import bisect
+import mmap
+import struct
+from typing import Iterable, Iterator
+from engine import base58, wire
+from engine.chain import HASH_SIZE
+from engine.game import Game, Result
+from engine.session import Session
+from engine.structs import GENESIS_HASH, Block, Transaction, TxOutput
+from engine.utxo import UtxoSet
+
+MAGIC = b'CMGS'
+VERSION = 3  # 2: the block section starts with the previous hash and the UTXO tip, 3: session section
+SECTIONS = ('index', 'outputs', 'block', 'rejected', 'results', 'session')
+_HEADER = struct.Struct(f'>4sB{2 * len(SECTIONS)}Q')
+_ENTRY = struct.Struct(f'>{wire.ID_SIZE}sIQ')  # tx_id, index, offset of the output record
+
+
+def _key(tx_id: str, index: int) -> bytes:  # sorts like the index entries
+    return base58.decode_int(tx_id).to_bytes(wire.ID_SIZE, 'big') + index.to_bytes(4, 'big')
+
+
+class SnapshotUtxoSet:  # same interface as UtxoSet, outputs are decoded from the mapped file on first access
+    def __init__(self, buf: mmap.mmap, index_offset: int, count: int):
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._index_offset = index_offset
+        self._count = count
+        self._loaded: dict[tuple[str, int], TxOutput] = {}  # decoded once, so changes (like spent) stick
+        self._removed: set[tuple[str, int]] = set()
+        self._added = UtxoSet()  # appended after the restore
+        self.tip = GENESIS_HASH  # see Chain
+
+    def _entry_key(self, position: int) -> bytes:
+        start = self._index_offset + position * _ENTRY.size
+        return self._buf[start:start + wire.ID_SIZE + 4]
+
+    def _lower_bound(self, key: bytes) -> int:
+        return bisect.bisect_left(range(self._count), key, key=self._entry_key)
+
+    def _read(self, position: int) -> TxOutput:
+        _, _, offset = _ENTRY.unpack_from(self._buf, self._index_offset + position * _ENTRY.size)
+        return wire.read_output(self._view, offset)[0]
+
+    def _load(self, position: int) -> TxOutput:
+        src = self._read(position)
+        return self._loaded.setdefault((src.tx_id, src.index), src)
+
+    def append(self, src: TxOutput):
+        if (src.tx_id, src.index) in self:
+            raise ValueError(f'Output {src.tx_id} #{src.index} is already in the UTXO set')
+        self._added.append(src)
+
+    def extend(self, outputs: Iterable[TxOutput]):
+        for src in outputs:
+            self.append(src)
+
+    def remove(self, tx_id: str, index: int) -> TxOutput:  # raises KeyError for non-existent outputs
+        if (tx_id, index) in self._added:
+            return self._added.remove(tx_id, index)
+        src = self.get(tx_id, index)
+        if src is None:
+            raise KeyError((tx_id, index))
+        self._removed.add((tx_id, index))
+        return src
+
+    def get(self, tx_id: str, index: int) -> TxOutput | None:
+        key = (tx_id, index)
+        src = self._added.get(tx_id, index)
+        if src is not None or key in self._removed:
+            return src
+        src = self._loaded.get(key)
+        if src is not None:
+            return src
+        try:
+            raw_key = _key(tx_id, index)
+        except (ValueError, OverflowError):  # not base58, or too long for the index - not in the set either way
+            return None
+        position = self._lower_bound(raw_key)
+        if position == self._count or self._entry_key(position) != raw_key:
+            return None
+        return self._load(position)
+
+    def get_many(self, keys: Iterable[tuple[str, int]]) -> dict[tuple[str, int], TxOutput]:  # only the ones found
+        found = {}
+        for key in keys:  # already in memory, a lookup is a bisect over the mapped index
+            src = self.get(*key)
+            if src is not None:
+                found[key] = src
+        return found
+
+    def is_spent(self, tx_id: str, index: int) -> bool:  # raises KeyError for non-existent outputs
+        src = self.get(tx_id, index)
+        if src is None:
+            raise KeyError((tx_id, index))
+        return src.spent
+
+    def mark_spent(self, tx_id: str, index: int, spent: bool = True):
+        src = self.get(tx_id, index)
+        if src is None:
+            raise KeyError((tx_id, index))
+        src.spent = spent
+
+    def lookup(self, tx_id: str) -> list[TxOutput]:  # ordered by index
+        res = self._added.lookup(tx_id)
+        try:
+            prefix = _key(tx_id, 0)[:wire.ID_SIZE]
+        except (ValueError, OverflowError):  # see get
+            return res
+        position = self._lower_bound(prefix + bytes(4))
+        while position < self._count and self._entry_key(position)[:wire.ID_SIZE] == prefix:
+            src = self._load(position)
+            if (src.tx_id, src.index) not in self._removed:
+                res.append(src)
+            position += 1
+        return sorted(res, key=lambda src: src.index)
+
+    def close(self):
+        self._view.release()
+        self._buf.close()
+
+    def __contains__(self, key: tuple[str, int]) -> bool:
+        return self.get(*key) is not None
+
+    def __len__(self) -> int:
+        return self._count - len(self._removed) + len(self._added)
+
+    def __iter__(self) -> Iterator[TxOutput]:  # outputs nobody asked for are decoded, but not kept
+        for position in range(self._count):
+            src = self._read(position)
+            key = (src.tx_id, src.index)
+            if key not in self._removed:
+                yield self._loaded.get(key, src)
+        yield from self._added
+
+
+def _write_transactions(out: bytearray, txs: list[Transaction]):
+    wire.write_varint(out, len(txs))
+    for tx in txs:
+        wire.write_transaction(out, tx)
+
+
+def _read_transactions(buf: memoryview, pos: int) -> tuple[list[Transaction], int]:
+    count, pos = wire.read_varint(buf, pos)
+    txs = []
+    for _ in range(count):
+        tx, pos = wire.read_transaction(buf, pos)
+        txs.append(tx)
+    return txs, pos
+
+
+def _write_optional(out: bytearray, value: int | None):  # 0 stands for None
+    wire.write_varint(out, 0 if value is None else value + 1)
+
+
+def _read_optional(buf: memoryview, pos: int) -> tuple[int | None, int]:
+    value, pos = wire.read_varint(buf, pos)
+    return (None if value == 0 else value - 1), pos
+
+
+def snapshot(game: Game, path: str, session: Session | None = None):  # with a session, see restore_session
+    outputs = sorted((_key(src.tx_id, src.index), src) for src in game.sources)
+    data_offset = _HEADER.size + len(outputs) * _ENTRY.size  # the outputs come right after the index
+    index, data = bytearray(), bytearray()
+    for key, src in outputs:
+        index += _ENTRY.pack(key[:wire.ID_SIZE], src.index, data_offset + len(data))
+        wire.write_output(data, src)
+
+    block, rejected, results = bytearray(), bytearray(), bytearray()
+    block += bytes.fromhex(game.block.prev_hash) + bytes.fromhex(game.sources.tip)
+    _write_transactions(block, game.block.transactions)
+    _write_transactions(rejected, game.rejected_tx)
+    positions = {tx.tx_id: i for i, tx in enumerate(game.block.transactions)}
+    positions.update((tx.tx_id, i) for i, tx in enumerate(game.rejected_tx))
+    wire.write_varint(results, len(game.results))
+    for r in game.results:  # results point into the block (accepted) or rejected_tx
+        results.append(1 if r.accepted else 0)
+        wire.write_varint(results, positions[r.tx.tx_id])
+    marked = [positions[tx_id] for tx_id in game.marked]  # outputs the block marked spent, undone by reject/reset
+    wire.write_varint(results, len(marked))
+    for position in marked:
+        wire.write_varint(results, position)
+
+    session_state = bytearray()
+    _write_transactions(session_state, [] if session is None or session.current_tx is None else [session.current_tx])
+    _write_optional(session_state, None if session is None else session.reward_requested)
+    _write_optional(session_state, None if session is None else session.found_nonce)
+
+    sections = [index, data, block, rejected, results, session_state]
+    table = []
+    offset = _HEADER.size
+    for section in sections:
+        table += [offset, len(section)]
+        offset += len(section)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, *table))
+        for section in sections:
+            f.write(section)
+
+
+def restore(path: str) -> Game:  # outputs stay in the file (memory-mapped) until they are used
+    return _restore(path)[0]
+
+
+def restore_session(path: str) -> Session:  # the game, and the player's pending transaction and requested reward
+    game, pending, reward_requested, found_nonce = _restore(path)
+    session = Session(game)
+    session.current_tx = pending
+    session.reward_requested = reward_requested
+    session.found_nonce = found_nonce
+    return session
+
+
+def _restore(path: str) -> tuple[Game, Transaction | None, int | None, int | None]:
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)  # copy-on-write, the file is never changed
+    magic, version, *table = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        buf.close()
+        raise ValueError(f'{path} is not a game snapshot')
+    if version != VERSION:
+        buf.close()
+        raise ValueError(f'Unsupported snapshot version {version} (expected {VERSION})')
+    sections = {name: (table[2 * i], table[2 * i + 1]) for i, name in enumerate(SECTIONS)}
+    index_offset, index_size = sections['index']
+    game = Game(sources=SnapshotUtxoSet(buf, index_offset, index_size // _ENTRY.size))
+
+    view = memoryview(buf)
+    pos = sections['block'][0]
+    block = Block(view[pos:pos + HASH_SIZE].hex())
+    game.sources.tip = view[pos + HASH_SIZE:pos + 2 * HASH_SIZE].hex()
+    for tx in _read_transactions(view, pos + 2 * HASH_SIZE)[0]:
+        block.add(tx)
+    game.block = block
+    game.rejected_tx = _read_transactions(view, sections['rejected'][0])[0]
+    pos = sections['results'][0]
+    count, pos = wire.read_varint(view, pos)
+    for _ in range(count):
+        accepted = view[pos] == 1
+        position, pos = wire.read_varint(view, pos + 1)
+        tx = block.transactions[position] if accepted else game.rejected_tx[position]
+        game.results.append(Result(tx, accepted))
+    count, pos = wire.read_varint(view, pos)
+    for _ in range(count):
+        position, pos = wire.read_varint(view, pos)
+        tx = block.transactions[position]
+        game.marked[tx.tx_id] = (tx.input.tx_id, tx.input.index)
+    pending, pos = _read_transactions(view, sections['session'][0])
+    reward_requested, pos = _read_optional(view, pos)
+    found_nonce, pos = _read_optional(view, pos)
+    view.release()
+    return game, (pending[0] if len(pending) > 0 else None), reward_requested, found_nonce
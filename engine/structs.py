@@ -1,14 +1,22 @@
-import inspect
 import hashlib
+from engine.merkle import MerkleTree, leaf_hash
 
 class OpCode:
-    def __init__(self, number: int, name: str, body):
+    __slots__ = ('number', 'name', 'body', 'argnum', 'pushes')
+
+    def __init__(self, number: int, name: str, body, argnum: int, pushes: int = 1):
         self.number = number
         self.name = name
         self.body = body
+        self.argnum = argnum  # items taken from the stack
+        self.pushes = pushes  # items put back - at most, OP_IFDUP puts back one item less for a zero
+
+    @property
+    def stack_effect(self) -> tuple[int, int]:  # (consumed, produced)
+        return self.argnum, self.pushes
 
     def apply(self, stack: list):
-        argnum = len(inspect.signature(self.body).parameters)
+        argnum = self.argnum
         if len(stack) < argnum:
             raise IndexError('Not enough elements on the stack')
         if argnum == 0:
@@ -30,6 +38,8 @@ class OpCode:
         return self.name
 
 class OpPushBytes(OpCode):
+    __slots__ = ('hex_bytes', 'dec')
+
     def __init__(self, hex_bytes: str):
         if len(hex_bytes) % 2 != 0:
             hex_bytes = '0' + hex_bytes
@@ -40,7 +50,7 @@ class OpPushBytes(OpCode):
         self.hex_bytes = hex_bytes
         self.dec = dec
         lambda_result = dec if byte_number <= 4 else hex_bytes
-        super().__init__(byte_number, f'OP_PUSHBYTES{byte_number}', lambda : lambda_result)
+        super().__init__(byte_number, f'OP_PUSHBYTES{byte_number}', lambda : lambda_result, argnum=0)
 
     def to_hex(self):
         return super().to_hex() + self.hex_bytes
@@ -50,33 +60,38 @@ class OpPushBytes(OpCode):
         return self.name + ':' + str(thing_to_show)
 
 class OpX(OpCode):
+    __slots__ = ()
+
     def __init__(self, number: int):
         if number > 16:
             raise ValueError('Trying to push number over 16 directly')
         elif number < -1:
             raise ValueError('Trying to push negative number (not -1) directly')
         elif number == -1:
-            super().__init__(79, 'OP_1NEGATE', lambda: -1)
+            super().__init__(79, 'OP_1NEGATE', lambda: -1, argnum=0)
         elif number == 0:
-            super().__init__(0, f'OP_0', lambda: 0)
+            super().__init__(0, f'OP_0', lambda: 0, argnum=0)
         else:
-            super().__init__(80 + number, f'OP_{number}', lambda: number)
+            super().__init__(80 + number, f'OP_{number}', lambda: number, argnum=0)
 
 
 class TxIO:  # transaction input or output
+    __slots__ = ('tx_id', 'index', 'script')
+
     def __init__(self, tx_id: str, index: int, script: list[OpCode]):
         self.tx_id = tx_id
         self.index = index
         self.script = script  # "chest lock" in case of outputs, "chest key" in case of inputs
 
 class TxInput(TxIO):
-    pass
+    __slots__ = ()
 
 class TxOutput(TxIO):
-    spent = False
+    __slots__ = ('amount', 'spent')
 
     def __init__(self, tx_id: str, index: int, script: list, amount: int):
         self.amount = amount
+        self.spent = False
         super().__init__(tx_id, index, script)
 
     def printable(self) -> str:
@@ -88,6 +103,8 @@ class TxOutput(TxIO):
 
 
 class Transaction:
+    __slots__ = ('tx_id', 'input', 'outputs', 'total', 'fee', 'error')
+
     def __init__(self, tx_id: str, input_: TxInput, outputs: list[TxOutput], total: int, fee: int, error: str):
         self.tx_id = tx_id
         self.input = input_
@@ -108,19 +125,61 @@ class Transaction:
         return ret
 
 
+GENESIS_HASH = '0' * 40  # "previous hash" of the first block
+
+
 class Block:
-    transactions: list[Transaction] = []
+    __slots__ = ('prev_hash', 'transactions', 'merkle', '_positions', 'fees', 'correct_fees', 'spent')
+    SUBSIDY = 312_500_000  # 3.125 BTC for mining the block
+
+    def __init__(self, prev_hash: str = GENESIS_HASH):
+        self.prev_hash = prev_hash  # hash of the block this one builds on, part of its own hash
+        self.transactions: list[Transaction] = []
+        self.merkle = MerkleTree()
+        self._positions: dict[str, int] = {}  # tx_id -> leaf position
+        self.fees = 0  # running totals, so reward() doesn't go through all transactions
+        self.correct_fees = 0
+        self.spent: dict[tuple[str, int], str] = {}  # (tx_id, index) spent by this block -> first spending tx_id
+
+    def add(self, tx: Transaction):  # double-spends are added too (the player may get it wrong), see conflicts
+        self._positions[tx.tx_id] = len(self.transactions)
+        self.transactions.append(tx)
+        self.merkle.append(leaf_hash(tx.tx_id))
+        self.fees += tx.fee
+        if tx.error == 'none':
+            self.correct_fees += tx.fee
+        self.spent.setdefault((tx.input.tx_id, tx.input.index), tx.tx_id)
+
+    def remove(self, tx: Transaction):  # O(n), the Merkle tree is rebuilt from the remaining transactions
+        remaining = [t for t in self.transactions if t.tx_id != tx.tx_id]
+        self.transactions = []
+        self.merkle = MerkleTree()
+        self._positions = {}
+        self.fees = self.correct_fees = 0
+        self.spent = {}
+        for t in remaining:
+            self.add(t)
+
+    def conflicts(self, tx: Transaction) -> bool:  # True if another transaction here spends the same output
+        spender = self.spent.get((tx.input.tx_id, tx.input.index))
+        return spender is not None and spender != tx.tx_id
+
+    def __contains__(self, tx_id: str) -> bool:
+        return tx_id in self._positions
+
+    def merkle_root(self) -> bytes:
+        return self.merkle.root()
+
+    def proof(self, tx_id: str) -> list[tuple[bytes, bool]]:  # check with merkle.verify_proof
+        return self.merkle.proof(self._positions[tx_id])
+
+    def header_prefix(self) -> bytes:  # everything hashed before the nonce
+        return bytes.fromhex(self.prev_hash) + self.merkle.root()
 
     def hash(self, nonce: int) -> str:
-        tx_ids = (tx.tx_id for tx in self.transactions)
-        cat = ''.join(sorted(tx_ids)) + str(nonce)
         sha1 = hashlib.sha1()
-        sha1.update(cat.encode('ascii'))
+        sha1.update(self.header_prefix() + str(nonce).encode('ascii'))
         return sha1.hexdigest()
 
     def reward(self, include_wrong: bool) -> int:
-        if include_wrong:
-            fees = (tx.fee for tx in self.transactions)
-        else:
-            fees = (tx.fee for tx in self.transactions if tx.error == 'none')
-        return 312_500_000 + sum(fees)
+        return self.SUBSIDY + (self.fees if include_wrong else self.correct_fees)
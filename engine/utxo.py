@@ -0,0 +1,217 @@
+import bisect
+import sqlite3
+from collections import OrderedDict
+from typing import Iterable, Iterator
+from engine.script import decode_script
+from engine.structs import GENESIS_HASH, TxOutput
+from engine.settings import UTXO_STORE, UTXO_DB_PATH, UTXO_CACHE_SIZE
+
+
+def _index_of(src: TxOutput) -> int:
+    return src.index
+
+
+class UtxoSet:  # outputs keyed by (tx_id, index), plus per-transaction lists ordered by index
+    def __init__(self, outputs: Iterable[TxOutput] = ()):
+        self._outputs: dict[tuple[str, int], TxOutput] = {}
+        self._by_tx_id: dict[str, list[TxOutput]] = {}
+        self.tip = GENESIS_HASH  # the last chain block applied to these outputs, see Chain
+        self.extend(outputs)
+
+    def append(self, src: TxOutput):
+        key = (src.tx_id, src.index)
+        if key in self._outputs:
+            raise ValueError(f'Output {src.tx_id} #{src.index} is already in the UTXO set')
+        self._outputs[key] = src
+        siblings = self._by_tx_id.get(src.tx_id)
+        if siblings is None:
+            self._by_tx_id[src.tx_id] = [src]
+        elif siblings[-1].index < src.index:
+            siblings.append(src)
+        else:
+            bisect.insort(siblings, src, key=_index_of)
+
+    def extend(self, outputs: Iterable[TxOutput]):
+        for src in outputs:
+            self.append(src)
+
+    def remove(self, tx_id: str, index: int) -> TxOutput:  # raises KeyError for non-existent outputs
+        src = self._outputs.pop((tx_id, index))
+        siblings = self._by_tx_id[tx_id]
+        siblings.remove(src)
+        if len(siblings) == 0:
+            del self._by_tx_id[tx_id]
+        return src
+
+    def get(self, tx_id: str, index: int) -> TxOutput | None:
+        return self._outputs.get((tx_id, index))
+
+    def get_many(self, keys: Iterable[tuple[str, int]]) -> dict[tuple[str, int], TxOutput]:  # only the ones found
+        outputs = self._outputs
+        return {key: outputs[key] for key in keys if key in outputs}
+
+    def is_spent(self, tx_id: str, index: int) -> bool:  # raises KeyError for non-existent outputs
+        return self._outputs[(tx_id, index)].spent
+
+    def mark_spent(self, tx_id: str, index: int, spent: bool = True):
+        self._outputs[(tx_id, index)].spent = spent
+
+    def lookup(self, tx_id: str) -> list[TxOutput]:  # ordered by index
+        return list(self._by_tx_id.get(tx_id, ()))
+
+    def __contains__(self, key: tuple[str, int]) -> bool:
+        return key in self._outputs
+
+    def __len__(self) -> int:
+        return len(self._outputs)
+
+    def __iter__(self) -> Iterator[TxOutput]:
+        return iter(self._outputs.values())
+
+
+_MANY_CHUNK = 400  # (tx_id, idx) pairs per SELECT, two variables each, well under SQLITE_MAX_VARIABLE_NUMBER
+
+
+class SqliteUtxoStore:  # same interface as UtxoSet, but outputs live in a sqlite file and survive restarts
+    # usable from any thread, but only from one at a time (like the pipeline's state thread)
+    def __init__(self, path: str, cache_size: int = 100_000, mmap_size: int = 256 * 1024 * 1024):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache: OrderedDict[tuple[str, int], TxOutput] = OrderedDict()  # decoded outputs, LRU order
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f'PRAGMA mmap_size = {int(mmap_size)}')  # reads go through memory-mapped pages
+        self._db.execute(f'PRAGMA cache_size = -{max(cache_size // 10, 2_000)}')  # in KiB
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS utxo ('
+            'tx_id TEXT NOT NULL, idx INTEGER NOT NULL, amount INTEGER NOT NULL, '
+            'spent INTEGER NOT NULL, script TEXT NOT NULL, PRIMARY KEY (tx_id, idx)) WITHOUT ROWID'
+        )
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'tip'").fetchone()
+        self._tip = GENESIS_HASH if row is None else row[0]
+
+    @property
+    def tip(self) -> str:  # the last chain block applied to these outputs, kept between runs, see Chain
+        return self._tip
+
+    @tip.setter
+    def tip(self, block_hash: str):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('tip', ?)", (block_hash,))
+        self._tip = block_hash
+
+    @staticmethod
+    def _row(src: TxOutput) -> tuple:
+        return src.tx_id, src.index, src.amount, int(src.spent), ''.join(opc.to_hex() for opc in src.script)
+
+    def _remember(self, src: TxOutput) -> TxOutput:
+        key = (src.tx_id, src.index)
+        self._cache[key] = src
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return src
+
+    def _output(self, row: tuple) -> TxOutput:
+        tx_id, index, amount, spent, script = row
+        cached = self._cache.get((tx_id, index))
+        if cached is not None:
+            return cached
+        src = TxOutput(tx_id, index, decode_script(script), amount)
+        src.spent = bool(spent)
+        return self._remember(src)
+
+    def append(self, src: TxOutput):
+        self.extend((src,))
+
+    def extend(self, outputs: Iterable[TxOutput]):  # one sqlite transaction per call
+        outputs = list(outputs)
+        try:
+            with self._db:
+                self._db.executemany('INSERT INTO utxo VALUES (?, ?, ?, ?, ?)', map(self._row, outputs))
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f'Output is already in the UTXO set: {e}')
+        for src in outputs:
+            self._remember(src)
+
+    def remove(self, tx_id: str, index: int) -> TxOutput:
+        src = self.get(tx_id, index)
+        if src is None:
+            raise KeyError((tx_id, index))
+        with self._db:
+            self._db.execute('DELETE FROM utxo WHERE tx_id = ? AND idx = ?', (tx_id, index))
+        self._cache.pop((tx_id, index), None)
+        return src
+
+    def get(self, tx_id: str, index: int) -> TxOutput | None:
+        key = (tx_id, index)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        row = self._db.execute('SELECT * FROM utxo WHERE tx_id = ? AND idx = ?', key).fetchone()
+        return None if row is None else self._output(row)
+
+    def get_many(self, keys: Iterable[tuple[str, int]]) -> dict[tuple[str, int], TxOutput]:  # only the ones found
+        found, missing = {}, []
+        for key in dict.fromkeys(keys):  # distinct, in order
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                found[key] = cached
+            else:
+                missing.append(key)
+        for start in range(0, len(missing), _MANY_CHUNK):  # one SELECT per chunk instead of one per output
+            chunk = missing[start:start + _MANY_CHUNK]
+            values = ', '.join(['(?, ?)'] * len(chunk))
+            params = [part for key in chunk for part in key]
+            query = f'SELECT utxo.* FROM (VALUES {values}) AS k CROSS JOIN utxo ' \
+                    'ON utxo.tx_id = k.column1 AND utxo.idx = k.column2'  # a primary key search per pair, not a scan
+            for row in self._db.execute(query, params):
+                src = self._output(row)
+                found[(src.tx_id, src.index)] = src
+        return found
+
+    def is_spent(self, tx_id: str, index: int) -> bool:  # raises KeyError for non-existent outputs
+        src = self.get(tx_id, index)
+        if src is None:
+            raise KeyError((tx_id, index))
+        return src.spent
+
+    def mark_spent(self, tx_id: str, index: int, spent: bool = True):
+        with self._db:
+            updated = self._db.execute('UPDATE utxo SET spent = ? WHERE tx_id = ? AND idx = ?', (int(spent), tx_id, index))
+        if updated.rowcount == 0:
+            raise KeyError((tx_id, index))
+        cached = self._cache.get((tx_id, index))
+        if cached is not None:
+            cached.spent = spent
+
+    def lookup(self, tx_id: str) -> list[TxOutput]:  # ordered by index
+        rows = self._db.execute('SELECT * FROM utxo WHERE tx_id = ? ORDER BY idx', (tx_id,))
+        return [self._output(row) for row in rows]
+
+    def close(self):
+        self._db.close()
+
+    def __contains__(self, key: tuple[str, int]) -> bool:
+        return self.get(*key) is not None
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM utxo').fetchone()[0]
+
+    def __iter__(self) -> Iterator[TxOutput]:
+        for row in self._db.execute('SELECT * FROM utxo ORDER BY tx_id, idx'):
+            yield self._output(row)
+
+
+def open_utxo_store(kind: str = UTXO_STORE) -> UtxoSet | SqliteUtxoStore:
+    if kind == 'memory':
+        return UtxoSet()
+    elif kind == 'sqlite':
+        return SqliteUtxoStore(UTXO_DB_PATH, cache_size=UTXO_CACHE_SIZE)
+    else:
+        raise ValueError(f'Unknown UTXO store: {kind}')
@@ -0,0 +1,61 @@
+import time
+from engine.script import ScriptCache, verification_cache
+from engine.structs import Transaction, TxOutput
+from engine.utxo import UtxoSet, SqliteUtxoStore
+
+
+class BatchResult:
+    def __init__(self, errors: list[str], elapsed: float, cache_hit_rate: float = 0.0):
+        self.errors = errors
+        self.elapsed = elapsed
+        self.cache_hit_rate = cache_hit_rate  # script verifications answered by the cache during this batch
+
+    @property
+    def tx_per_sec(self) -> float:
+        return len(self.errors) / self.elapsed if self.elapsed > 0 else float('inf')
+
+    def summary(self) -> dict[str, int]:
+        res = {}
+        for e in self.errors:
+            res[e] = res.get(e, 0) + 1
+        return res
+
+    def printable(self) -> str:
+        return f'Validated {len(self.errors)} transactions in {self.elapsed:.3f}s ({self.tx_per_sec:,.0f} tx/sec), ' \
+               f'{self.cache_hit_rate:.1%} script cache hits'
+
+
+class Validator:  # decides the same error labels that generator.generate_tx assigns
+    def __init__(self, sources: list[TxOutput] | UtxoSet | SqliteUtxoStore, cache: ScriptCache = verification_cache):
+        # a UTXO store (like Game.sources) is used as is, so outputs added to it later are visible too
+        self.utxos = UtxoSet(sources) if isinstance(sources, list) else sources
+        self.cache = cache  # shared by all validators unless given their own
+
+    def add_sources(self, sources: list[TxOutput]):
+        self.utxos.extend(sources)
+
+    def script_passes(self, script_sig: list, script_pub_key: list) -> bool:
+        return self.cache.verify(script_sig, script_pub_key) is None
+
+    def validate(self, tx: Transaction) -> str:
+        return self._check(tx, self.utxos.get(tx.input.tx_id, tx.input.index))
+
+    def _check(self, tx: Transaction, src: TxOutput | None) -> str:
+        if src is None:
+            return 'invalid_input'
+        if src.spent:
+            return 'already_spent'
+        if not self.script_passes(tx.input.script, src.script):
+            return 'script_failed'
+        if sum(out.amount for out in tx.outputs) > src.amount:
+            return 'negative_fee'
+        return 'none'
+
+    def validate_batch(self, txs: list[Transaction]) -> BatchResult:
+        hits, misses = self.cache.hits, self.cache.misses
+        start = time.perf_counter()
+        sources = self.utxos.get_many((tx.input.tx_id, tx.input.index) for tx in txs)  # one query on sqlite
+        errors = [self._check(tx, sources.get((tx.input.tx_id, tx.input.index))) for tx in txs]
+        elapsed = time.perf_counter() - start
+        hits, lookups = self.cache.hits - hits, self.cache.hits + self.cache.misses - hits - misses
+        return BatchResult(errors, elapsed, hits / lookups if lookups > 0 else 0.0)
@@ -0,0 +1,177 @@
+# Compact binary records: varints, raw 32-byte ids and raw script bytes
+import mmap
+from typing import BinaryIO, Iterable, Iterator
+from engine import base58
+from engine.script import decode_script, encode_script
+from engine.structs import OpPushBytes, Transaction, TxInput, TxOutput
+
+TX_RECORD = 1
+OUTPUT_RECORD = 2
+ERRORS = ('none', 'script_failed', 'negative_fee', 'invalid_input', 'already_spent')
+_ERROR_CODES = {e: i for i, e in enumerate(ERRORS)}
+ID_SIZE = 32
+
+
+def write_varint(out: bytearray, value: int):  # unsigned LEB128
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def varint_size(value: int) -> int:
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def read_varint(buf: memoryview, pos: int) -> tuple[int, int]:  # (value, position after it)
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:  # fees can be negative
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _write_id(out: bytearray, tx_id: str):
+    number = base58.decode_int(tx_id)
+    if number.bit_length() > ID_SIZE * 8:
+        raise ValueError(f'Transaction id {tx_id} does not fit in {ID_SIZE} bytes')
+    out += number.to_bytes(ID_SIZE, 'big')
+
+
+def _read_id(buf: memoryview, pos: int) -> tuple[str, int]:
+    return base58.encode(int.from_bytes(buf[pos:pos + ID_SIZE], 'big')), pos + ID_SIZE
+
+
+def _write_script(out: bytearray, script: list):
+    raw = encode_script(script)
+    write_varint(out, len(raw))
+    out += raw
+
+
+def _read_script(buf: memoryview, pos: int) -> tuple[list, int]:
+    length, pos = read_varint(buf, pos)
+    return decode_script(buf[pos:pos + length]), pos + length
+
+
+def _script_size(script: list) -> int:  # one byte per opcode, plus the pushed bytes
+    raw = len(script) + sum(len(opc.hex_bytes) // 2 for opc in script if type(opc) is OpPushBytes)
+    return varint_size(raw) + raw
+
+
+def _output_size(src: TxOutput) -> int:
+    return ID_SIZE + varint_size(src.index) + varint_size(src.amount) + 1 + _script_size(src.script)
+
+
+def transaction_size(tx: Transaction) -> int:  # len(encode_records((tx,))), without encoding anything
+    return 1 + 2 * ID_SIZE + varint_size(tx.input.index) + _script_size(tx.input.script) + \
+        varint_size(len(tx.outputs)) + sum(_output_size(output) for output in tx.outputs) + \
+        varint_size(tx.total) + varint_size(_zigzag(tx.fee)) + 1
+
+
+def write_output(out: bytearray, src: TxOutput):
+    _write_id(out, src.tx_id)
+    write_varint(out, src.index)
+    write_varint(out, src.amount)
+    out.append(1 if src.spent else 0)
+    _write_script(out, src.script)
+
+
+def read_output(buf: memoryview, pos: int) -> tuple[TxOutput, int]:
+    tx_id, pos = _read_id(buf, pos)
+    index, pos = read_varint(buf, pos)
+    amount, pos = read_varint(buf, pos)
+    spent = buf[pos] == 1
+    script, pos = _read_script(buf, pos + 1)
+    src = TxOutput(tx_id, index, script, amount)
+    src.spent = spent
+    return src, pos
+
+
+def write_transaction(out: bytearray, tx: Transaction):
+    _write_id(out, tx.tx_id)
+    _write_id(out, tx.input.tx_id)
+    write_varint(out, tx.input.index)
+    _write_script(out, tx.input.script)
+    write_varint(out, len(tx.outputs))
+    for output in tx.outputs:
+        write_output(out, output)
+    write_varint(out, tx.total)
+    write_varint(out, _zigzag(tx.fee))
+    out.append(_ERROR_CODES[tx.error])
+
+
+def read_transaction(buf: memoryview, pos: int) -> tuple[Transaction, int]:
+    tx_id, pos = _read_id(buf, pos)
+    input_tx_id, pos = _read_id(buf, pos)
+    input_index, pos = read_varint(buf, pos)
+    input_script, pos = _read_script(buf, pos)
+    outputs_num, pos = read_varint(buf, pos)
+    outputs = []
+    for _ in range(outputs_num):
+        output, pos = read_output(buf, pos)
+        outputs.append(output)
+    total, pos = read_varint(buf, pos)
+    fee, pos = read_varint(buf, pos)
+    error = ERRORS[buf[pos]]
+    tx = Transaction(tx_id, TxInput(input_tx_id, input_index, input_script), outputs, total, _unzigzag(fee), error)
+    return tx, pos + 1
+
+
+def encode_records(items: Iterable[Transaction | TxOutput]) -> bytes:  # every record starts with its type byte
+    out = bytearray()
+    for item in items:
+        if isinstance(item, Transaction):
+            out.append(TX_RECORD)
+            write_transaction(out, item)
+        else:
+            out.append(OUTPUT_RECORD)
+            write_output(out, item)
+    return bytes(out)
+
+
+def iter_records(buf: bytes | memoryview) -> Iterator[Transaction | TxOutput]:  # parses in place, no copies
+    buf = memoryview(buf)
+    pos = 0
+    while pos < len(buf):
+        kind = buf[pos]
+        if kind == TX_RECORD:
+            item, pos = read_transaction(buf, pos + 1)
+        elif kind == OUTPUT_RECORD:
+            item, pos = read_output(buf, pos + 1)
+        else:
+            raise ValueError(f'Unknown record type {kind} at byte {pos}')
+        yield item
+
+
+def write_records(f: BinaryIO, items: Iterable[Transaction | TxOutput], batch: int = 10_000):
+    pending = []
+    for item in items:
+        pending.append(item)
+        if len(pending) >= batch:
+            f.write(encode_records(pending))
+            pending.clear()
+    f.write(encode_records(pending))
+
+
+def read_records(path: str) -> Iterator[Transaction | TxOutput]:  # the file is memory-mapped, not read into memory
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            buf = memoryview(mapped)
+            try:
+                yield from iter_records(buf)
+            finally:
+                buf.release()